@@ -0,0 +1,5 @@
+"""
+Benchmarks of the counting engine on seeded synthetic elections. Run the modules from the repository root:
+python -m benchmarks.run   Time, peak memory and loop counts per engine mode and election size
+python -m benchmarks.memory   Bytes per ballot per engine mode
+"""
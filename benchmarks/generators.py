@@ -0,0 +1,102 @@
+"""
+Seeded synthetic elections.
+Voters mostly follow party lists, optionally truncated, across the confessional groups of a district.
+The same parameters and seed always give the same ballots, which are regenerated on demand instead of kept in memory.
+"""
+import os
+import random
+from itertools import accumulate
+from typing import List, Dict, Tuple, Iterator
+
+from stv_lebanon.stv import STV
+
+# Seats by confessional group, after the 2018 districts
+DISTRICTS: Dict[str, List[Tuple[str, int]]] = {
+    'beirut2': [('sunni', 6), ('shia', 2), ('druze', 1), ('orthodox', 1), ('evangelical', 1)],
+    'chouf_aley': [('maronite', 5), ('druze', 4), ('sunni', 2), ('catholic', 1), ('orthodox', 1)],
+    'north3': [('maronite', 7), ('orthodox', 3)],
+    'sample': [('christian', 2), ('muslim', 2), ('druze', 1)],
+}
+
+
+class Election:
+    """ Parameters of a synthetic election """
+    def __init__(self,
+                 voters: int,
+                 seed: int = 0,
+                 district: str = 'beirut2',
+                 candidatesperseat: int = 3,
+                 partylists: int = 6,
+                 listshare: float = 0.8,
+                 truncation: float = 0.3,
+                 ballotlength: int = 0
+                 ):
+        self.voters = voters
+        self.seed = seed
+        self.district = district
+        self.candidatesperseat = candidatesperseat
+        self.partylists = partylists  # Number of lists. Their popularity decreases like 1/rank
+        self.listshare = listshare  # Share of voters copying a list. The others pick candidates at random
+        self.truncation = truncation  # Share of ballots cut after a random position
+        self.ballotlength = ballotlength or sum(seats for _, seats in DISTRICTS[district])
+
+        self.groups = DISTRICTS[district]
+        self.candidates: List[Tuple[str, str, str]] = []  # Code, name and group
+        for groupname, seats in self.groups:
+            for i in range(seats * candidatesperseat):
+                code = f'{groupname[:3]}{i}'
+                self.candidates.append((code, f'{groupname.capitalize()} {i}', groupname))
+
+        # Each list fields at most as many candidates of a group as the group has seats, like in Lebanon
+        rand = random.Random(seed)
+        self.lists: List[List[str]] = []
+        for _ in range(partylists):
+            plist = []
+            for groupname, seats in self.groups:
+                groupcodes = [code for code, _, g in self.candidates if g == groupname]
+                plist += rand.sample(groupcodes, seats)
+            rand.shuffle(plist)
+            self.lists.append(plist[:self.ballotlength])
+        self.listweights = list(accumulate(1 / rank for rank in range(1, partylists + 1)))
+
+    def __repr__(self):
+        return f"Election({self.district}, {self.voters} voters, seed {self.seed})"
+
+    @property
+    def totalseats(self) -> int:
+        return sum(seats for _, seats in self.groups)
+
+    def ballots(self) -> Iterator[Tuple[str, List[str]]]:
+        """ Yield voter ids with their preference lists """
+        rand = random.Random(self.seed + 1)
+        codes = [code for code, _, _ in self.candidates]
+        for v in range(self.voters):
+            if rand.random() < self.listshare:
+                ballot = list(rand.choices(self.lists, cum_weights=self.listweights)[0])
+                if rand.random() < 0.2:  # Personal preference inside the list
+                    i = rand.randrange(len(ballot))
+                    ballot.insert(0, ballot.pop(i))
+            else:
+                ballot = rand.sample(codes, rand.randint(1, self.ballotlength))
+            if rand.random() < self.truncation:
+                ballot = ballot[:rand.randint(1, len(ballot))]
+            yield f'v{v}', ballot
+
+    def fill(self, stv: STV) -> None:
+        """ Add groups, candidates and ballots to an empty STV """
+        for groupname, seats in self.groups:
+            stv.add_group(groupname, seats)
+        for code, name, groupname in self.candidates:
+            stv.add_candidate(code, name, groupname)
+        for uid, ballot in self.ballots():
+            stv.add_voter(uid, ballot)
+
+    def write_csv(self, directory: str) -> None:
+        """ Write Groups.csv, Candidates.csv and Votes.csv as read by the command line interface """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'Groups.csv'), 'w') as f:
+            f.writelines(f'{groupname},{seats}\n' for groupname, seats in self.groups)
+        with open(os.path.join(directory, 'Candidates.csv'), 'w') as f:
+            f.writelines(f'{code},{name},{groupname}\n' for code, name, groupname in self.candidates)
+        with open(os.path.join(directory, 'Votes.csv'), 'w') as f:
+            f.writelines(uid + ',' + ','.join(ballot) + '\n' for uid, ballot in self.ballots())
@@ -0,0 +1,73 @@
+"""
+Incremental counts against full recounts as ballots arrive in batches.
+After each batch, the provisional result of an IncrementalCount is compared with a full count of the same ballots.
+Run from the repository root: python -m benchmarks.incremental [-v VOTERS] [-b BATCHES]
+"""
+import argparse
+import json
+import time
+from typing import List, Tuple
+
+from stv_lebanon.incremental import IncrementalCount
+from stv_lebanon.stv import STVResult, create_stv
+from .generators import DISTRICTS, Election
+
+
+def full_count(election: Election, ballots: list, usegroups: bool, reactivation: bool,
+               aggregate: bool) -> Tuple[STVResult, float]:
+    """ Count the ballots from the start and return the result with the time it took """
+    starttime = time.perf_counter()
+    stv = create_stv('object', usegroups, reactivation, aggregate)
+    for groupname, seats in election.groups:
+        stv.add_group(groupname, seats)
+    for code, name, groupname in election.candidates:
+        stv.add_candidate(code, name, groupname)
+    stv.add_voters(ballots)
+    result = stv.run_to_completion()
+    return result, time.perf_counter() - starttime
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Warm started incremental counts against full recounts")
+    parser.add_argument('-v', dest='voters', type=int, default=50000, help="Number of voters")
+    parser.add_argument('-b', dest='batches', type=int, default=25, help="Number of batches the ballots arrive in")
+    parser.add_argument('-r', dest='seed', type=int, default=0, help="Random seed")
+    parser.add_argument('-d', dest='district', default='beirut2', choices=DISTRICTS, help="Seats by group")
+    parser.add_argument('-g', dest='group', action='store_true', help="Use group quotas")
+    parser.add_argument('-n', dest='reactivation', action='store_false', help="No reactivation")
+    parser.add_argument('-a', dest='aggregate', action='store_true', help="Count identical ballots once")
+    parser.add_argument('-o', dest='output', default=None, metavar="FILE", help="Write results as JSON")
+    args = parser.parse_args()
+    election = Election(args.voters, args.seed, args.district)
+    ballots = list(election.ballots())
+    options = (args.group, args.reactivation, args.aggregate)
+
+    incremental = IncrementalCount(election.groups, election.candidates, *options)
+    results: List[dict] = []
+    print(f"{'Batch':>6}{'Ballots':>9}  {'Start':<6}{'Incremental s':>14}{'Full s':>8}  Same winners")
+    for k in range(args.batches):
+        end = (k + 1) * args.voters // args.batches
+        provisional = incremental.add_batch(ballots[k * args.voters // args.batches:end])
+        result, seconds = full_count(election, ballots[:end], *options)
+        same = sorted(code for code, _ in provisional.result.winners) == sorted(code for code, _ in result.winners)
+        results.append({'batch': k + 1, 'ballots': end, 'warm': provisional.warm, 'seconds': provisional.seconds,
+                        'fullseconds': seconds, 'samewinners': same,
+                        'wastedifference': provisional.result.totalwaste - result.totalwaste})
+        print(f"{k + 1:>6}{end:>9}  {'warm' if provisional.warm else 'full':<6}{provisional.seconds:>14.2f}"
+              f"{seconds:>8.2f}  {same}")
+
+    incrementaltime = sum(r['seconds'] for r in results)
+    fulltime = sum(r['fullseconds'] for r in results)
+    print(f"\nWarm starts: {incremental.warmstarts} of {args.batches} batches. Same winners: "
+          f"{sum(r['samewinners'] for r in results)} of {args.batches}")
+    print(f"Incremental: {incrementaltime:.1f}s  Full recounts: {fulltime:.1f}s  "
+          f"Speedup: {fulltime / incrementaltime if incrementaltime else 0:.1f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'voters': args.voters, 'batches': args.batches, 'seed': args.seed, 'district': args.district,
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
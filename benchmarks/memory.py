@@ -0,0 +1,50 @@
+"""
+Memory used per ballot by each counting engine.
+Run from the repository root: python -m benchmarks.memory [-v VOTERS]
+"""
+import argparse
+import tracemalloc
+from typing import List, Tuple
+
+from stv_lebanon.stv import STVSetupException, create_stv
+from .generators import DISTRICTS, Election
+
+MODES: List[Tuple[str, bool]] = [('object', False), ('object', True), ('numpy', False)]
+
+
+def measure(engine: str, aggregate: bool, election: Election) -> Tuple[int, int]:
+    """ Return bytes held once ballots are loaded and peak bytes while counting """
+    create_stv(engine, aggregate=aggregate)  # Engine modules are imported outside the measure
+    tracemalloc.start()
+    stv = create_stv(engine, aggregate=aggregate)
+    election.fill(stv)
+    counting = stv.start()
+    next(counting)  # Engines finish building their storage before the first yield
+    loaded = tracemalloc.get_traced_memory()[0]
+    for _ in counting:
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return loaded, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memory used per ballot by each counting engine")
+    parser.add_argument('-v', dest='voters', type=int, default=100000, help="Number of voters")
+    parser.add_argument('-r', dest='seed', type=int, default=0, help="Random seed")
+    parser.add_argument('-d', dest='district', default='beirut2', choices=DISTRICTS, help="Seats by group")
+    args = parser.parse_args()
+    election = Election(args.voters, args.seed, args.district)
+
+    print(f"{'Engine':<10}{'Aggregate':<11}{'Loaded B/ballot':>16}{'Peak B/ballot':>15}")
+    for engine, aggregate in MODES:
+        try:
+            loaded, peak = measure(engine, aggregate, election)
+        except STVSetupException as e:
+            print(f"{engine:<10}{str(aggregate):<11}  skipped: {e}")
+            continue
+        print(f"{engine:<10}{str(aggregate):<11}{loaded / args.voters:>16,.0f}{peak / args.voters:>15,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Scaling benchmark of the counting engine.
+Every case runs in a fresh process so peak memory is not shared between cases.
+Run from the repository root: python -m benchmarks.run -v 1000 10000 100000 -o results.json
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+from typing import List, Dict, Optional
+
+from stv_lebanon import lambda_function
+from stv_lebanon.stv import STVSetupException, create_stv
+from stv_lebanon.stv_progress import STVProgress
+from .generators import DISTRICTS, Election
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+MODES: Dict[str, dict] = {
+    'object': {},
+    'aggregate': {'aggregate': True},
+    'numpy': {'engine': 'numpy'},
+    'numpy-aggregate': {'engine': 'numpy', 'aggregate': True},
+    'accelerated': {'acceleration': 1e-4},
+}
+TARGETS = ('count', 'result', 'progress', 'lambda')
+
+
+def peak_memory() -> Optional[int]:
+    """ Peak resident memory of this process in bytes """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def run_case(target: str, mode: str, election: Election, usegroups: bool, reactivation: bool) -> dict:
+    """ Load and count one election. Meant to run in its own process """
+    options = dict(MODES[mode])
+    record = {'target': target, 'mode': mode, 'voters': election.voters, 'seed': election.seed,
+              'district': election.district, 'usegroups': usegroups, 'reactivation': reactivation}
+
+    if target == 'lambda':
+        return run_lambda(record, mode, election, usegroups, reactivation)
+
+    starttime = time.perf_counter()
+    stv = create_stv(options.pop('engine', 'object'), usegroups, reactivation, **options)
+    election.fill(stv)
+    record['loadtime'] = time.perf_counter() - starttime
+
+    # Only the count target collects counters. The profile also sees allocations made while reducing
+    profile = stv.enable_profiling() if target == 'count' else None
+    starttime = time.perf_counter()
+    if target == 'count':  # Walk every yield
+        for _ in stv.start():
+            pass
+    elif target == 'result':
+        stv.run_to_completion()
+    else:
+        for _ in STVProgress(stv).get_tansform_and_position():
+            pass
+    record['counttime'] = time.perf_counter() - starttime
+
+    record.update(rounds=stv.rounds, loops=None, allocations=None, reductions=None, decisions=None,
+                  winners=[c.code for c in stv.winners], peakmemory=peak_memory())
+    if profile is not None:
+        record.update(loops=profile.loops, allocations=profile.dirty, reductions=sum(profile.reductions.values()),
+                      decisions=len(profile.events))
+    return record
+
+
+def run_lambda(record: dict, mode: str, election: Election, usegroups: bool, reactivation: bool) -> dict:
+    """ Time lambda_handler on an event holding the whole election. Building the event is not timed """
+    lambda_function.VOTES_LIMIT = election.voters
+    lambda_function.TIME_BUDGET = lambda_function.MEMORY_BUDGET = float('inf')  # Time the full detail level
+    options = MODES[mode]
+    event = {
+        'usegroups': usegroups, 'reactivation': reactivation,
+        'groups': [{'name': name, 'seats': seats} for name, seats in election.groups],
+        'candidates': [{'code': code, 'name': name, 'group': group} for code, name, group in election.candidates],
+        'votes': [{'voterid': uid, 'ballot': ballot} for uid, ballot in election.ballots()],
+        'engine': options.get('engine', 'object'), 'aggregate': options.get('aggregate', False), 'detail': 'loop',
+        'acceleration': options.get('acceleration')
+    }
+    starttime = time.perf_counter()
+    response = lambda_function.lambda_handler(event, None)
+    record['loadtime'] = 0.0
+    record['counttime'] = time.perf_counter() - starttime
+
+    lastloop = response['loops'][-1]
+    record.update(rounds=lastloop['round'], loops=None, allocations=None, reductions=None, decisions=None,
+                  positions=len(response['loops']), peakmemory=peak_memory(),
+                  winners=[code for code, c in lastloop['candidates'].items() if c['status'] == 'winner'])
+    return record
+
+
+def run_isolated(*args) -> dict:
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(run_case, args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time and memory of the counting engine on synthetic elections")
+    parser.add_argument('-v', dest='sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Numbers of voters")
+    parser.add_argument('-m', dest='modes', nargs='+', default=list(MODES), choices=MODES, help="Engine modes")
+    parser.add_argument('-t', dest='target', default='count', choices=TARGETS,
+                        help="What to time: the full count, results only, STVProgress or lambda_handler")
+    parser.add_argument('-d', dest='district', default='beirut2', choices=DISTRICTS, help="Seats by group")
+    parser.add_argument('-r', dest='seed', type=int, default=0, help="Random seed")
+    parser.add_argument('-g', dest='group', action='store_true', help="Use group quotas")
+    parser.add_argument('-n', dest='reactivation', action='store_false', help="No reactivation")
+    parser.add_argument('-o', dest='output', default=None, metavar="FILE", help="Write results as JSON")
+    args = parser.parse_args()
+
+    results: List[dict] = []
+    print(f"{'Voters':>9} {'Mode':<16}{'Load s':>8}{'Count s':>9}{'Peak MB':>9}{'Rounds':>7}{'Loops':>7}"
+          f"{'Alloc':>10}{'Reduc':>7}")
+    for voters in args.sizes:
+        election = Election(voters, args.seed, args.district)
+        for mode in args.modes:
+            try:
+                r = run_isolated(args.target, mode, election, args.group, args.reactivation)
+            except STVSetupException as e:
+                print(f"{voters:>9} {mode:<16}skipped: {e}")
+                continue
+            results.append(r)
+            peak = '-' if r['peakmemory'] is None else f"{r['peakmemory'] / 2 ** 20:.0f}"
+            loops, allocations, reductions = ('-' if r[name] is None else r[name]
+                                              for name in ('loops', 'allocations', 'reductions'))
+            print(f"{voters:>9} {mode:<16}{r['loadtime']:>8.2f}{r['counttime']:>9.2f}{peak:>9}{r['rounds']:>7}"
+                  f"{loops:>7}{allocations:>10}{reductions:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -172,6 +172,7 @@ class STVBlender:
         votefillheightratio = stv.totalseats * bucketheightratio / votercount
 
         self.viewvoter = stv.voters.get(viewid) if viewid is not None else None
+        viewtrajectory = stvp.trajectory(viewid) if self.viewvoter is not None else None
         self.textstrips: List[TextStrip] = []
         overlay_round = TextOverLay('Rounds', 2, 0, 1, 'LEFT', 'TOP', 50)
         overlay_looptype = TextOverLay('Message', 3, 0.5, 1, 'CENTER', 'TOP', 50)
@@ -273,11 +274,10 @@ class STVBlender:
                 if self.viewvoter is not None:
                     text = "{}'s ballot".format(viewid)
                     lineformat = '\n{:16} {:>4.0%}'
-                    for vl in self.viewvoter.votelinks:
-                        candcode = vl.candidate.code
-                        vf = pos.votefractions[(viewid, candcode)]
+                    viewfractions, viewwaste = viewtrajectory.at(pos.index)
+                    for vl, vf in zip(self.viewvoter.votelinks, viewfractions):
                         text += lineformat.format(vl.candidate.name[:16], vf.fraction)
-                    text += lineformat.format('Waste', pos.waste[viewid])
+                    text += lineformat.format('Waste', viewwaste)
                     self.textstrips.append(TextStrip(overlay_tracking, text, looproundstartf, frame, grey))
         self.lastframe = frame
 
@@ -0,0 +1,144 @@
+"""
+Binary ballot files.
+One file holds a district ready to count: a JSON header with the groups and candidates, then the ballots in CSR
+layout, as row offsets into one array of candidate ids, with an optional multiplicity per row and the voter ids.
+Candidate ids are positions in the header's candidate table. Arrays are stored in native byte order, aligned to 8
+bytes, and read straight from a memory map.
+
+    magic 'STVB' | version u32 | header length u64 | header | offsets u64 x (rows + 1) | candidate ids u16 x entries
+    | multiplicities u32 x rows, optional | voter ids, utf-8 joined by newlines
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+from typing import List, Tuple, Optional, Iterator
+
+from .ballots import BallotSet
+from .stv import STV, STVSetupException
+
+MAGIC = b'STVB'
+VERSION = 1
+PREFIX = struct.Struct('<4sIQ')
+
+
+def _padding(size: int) -> int:
+    return -size % 8
+
+
+def write_ballot_file(ballotset: BallotSet, path: str, aggregate: bool = False) -> None:
+    """
+    Write a BallotSet as a binary ballot file. With aggregate, identical ballots become one row with a multiplicity,
+    keeping the first voter id
+    """
+    codeids = {code: i for i, (code, _, _) in enumerate(ballotset.candidates)}
+    rows = {}
+    offsets = array('Q', [0])
+    candidateids = array('H')
+    multiplicities = array('I')
+    uids = []
+    for uid, ballot in ballotset.ballots:
+        if aggregate:
+            row = rows.get(ballot)
+            if row is not None:
+                multiplicities[row] += 1
+                continue
+            rows[ballot] = len(uids)
+        candidateids.extend(codeids[code] for code in dict.fromkeys(ballot) if code in codeids)
+        offsets.append(len(candidateids))
+        multiplicities.append(1)
+        uids.append(uid)
+    uidbytes = '\n'.join(uids).encode()
+
+    header = json.dumps({'groups': ballotset.groups, 'candidates': ballotset.candidates, 'rows': len(uids),
+                         'entries': len(candidateids), 'multiplicities': aggregate, 'uidbytes': len(uidbytes),
+                         'byteorder': sys.byteorder}).encode()
+    with open(path, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, VERSION, len(header)))
+        f.write(header + bytes(_padding(PREFIX.size + len(header))))
+        f.write(offsets.tobytes())
+        f.write(candidateids.tobytes() + bytes(_padding(len(candidateids) * candidateids.itemsize)))
+        if aggregate:
+            f.write(multiplicities.tobytes() + bytes(_padding(len(multiplicities) * multiplicities.itemsize)))
+        f.write(uidbytes)
+
+
+class BallotFile:
+    """ Memory mapped binary ballot file. Arrays are views of the mapped file, nothing is copied until counted """
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+
+        magic, version, headerlength = PREFIX.unpack_from(self._map)
+        if magic != MAGIC:
+            raise STVSetupException(f"{path} is not a ballot file")
+        if version != VERSION:
+            raise STVSetupException(f"{path} has ballot file version {version}. Expected {VERSION}")
+        position = PREFIX.size
+        header = json.loads(bytes(view[position:position + headerlength]))
+        if header['byteorder'] != sys.byteorder:
+            raise STVSetupException(f"{path} was written on a {header['byteorder']} endian machine")
+        position += headerlength + _padding(position + headerlength)
+
+        self.groups: List[Tuple[str, int]] = [tuple(group) for group in header['groups']]
+        self.candidates: List[Tuple[str, str, str]] = [tuple(candidate) for candidate in header['candidates']]
+        self.rows: int = header['rows']
+
+        def take(typecode: str, count: int) -> memoryview:
+            nonlocal position
+            size = count * struct.calcsize(typecode)
+            values = view[position:position + size].cast(typecode)
+            position += size + _padding(size)
+            return values
+
+        self.offsets = take('Q', self.rows + 1)
+        self.candidateids = take('H', header['entries'])
+        self.multiplicities: Optional[memoryview] = take('I', self.rows) if header['multiplicities'] else None
+        self._uidbytes = view[position:position + header['uidbytes']]
+        self._uids: Optional[List[str]] = None
+
+    def __repr__(self):
+        return f"BallotFile({len(self.candidates)} candidates, {self.rows} rows)"
+
+    def __len__(self) -> int:
+        return self.rows
+
+    @property
+    def uids(self) -> List[str]:
+        """ Voter id of each row. Decoded on first use """
+        if self._uids is None:
+            self._uids = bytes(self._uidbytes).decode().split('\n') if self.rows else []
+        return self._uids
+
+    @property
+    def ballotcount(self) -> int:
+        return sum(self.multiplicities) if self.multiplicities is not None else self.rows
+
+    def ballots(self) -> Iterator[Tuple[str, Tuple[str, ...]]]:
+        """ Voter ids and candidate codes of each row """
+        codes = [code for code, _, _ in self.candidates]
+        offsets = self.offsets
+        candidateids = self.candidateids
+        for row, uid in enumerate(self.uids):
+            yield uid, tuple([codes[i] for i in candidateids[offsets[row]:offsets[row + 1]]])
+
+    def fill(self, stv: STV) -> None:
+        """ Add groups, candidates and ballots to an empty STV. The numpy engine takes the arrays as they are """
+        for groupname, seats in self.groups:
+            stv.add_group(groupname, seats)
+        for code, name, groupname in self.candidates:
+            stv.add_candidate(code, name, groupname)
+        if hasattr(stv, 'add_csr'):  # Candidate ids match the engine's indexes since candidates were added in order
+            stv.add_csr(self.uids, self.offsets, self.candidateids, self.multiplicities)
+        else:
+            stv.add_voters(self.ballots(), self.multiplicities)
+
+    def close(self) -> None:
+        self.offsets.release()
+        self.candidateids.release()
+        if self.multiplicities is not None:
+            self.multiplicities.release()
+        self._uidbytes.release()
+        self._map.close()
@@ -0,0 +1,151 @@
+"""
+Election input parsed once.
+A BallotSet holds groups, candidates and ballots as plain tuples, so it can fill any number of STV instances and be
+sent to worker processes without parsing the files again.
+Votes files are read in large blocks and cleaned in bulk. Problems are counted and summarized once, instead of
+printed for every ballot.
+"""
+import time
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator
+
+from .stv import STVSetupException
+
+BLOCK_SIZE = 1 << 22  # Characters read at a time from a votes file
+
+
+class LoadReport:
+    """ Counts and timing of a votes file load """
+    def __init__(self):
+        self.ballots = 0
+        self.seconds = 0.0
+        self.invalidcodes: Dict[str, int] = {}  # Occurrences of codes that are not candidates
+        self.invalidballots = 0  # Ballots with at least one invalid code
+        self.repeatedballots = 0  # Ballots naming a candidate more than once
+
+    @property
+    def ballotspersecond(self) -> float:
+        return self.ballots / self.seconds if self.seconds else 0.0
+
+    def warnings(self) -> List[str]:
+        """ One line per kind of problem. Invalid and repeated codes were left out of the ballots """
+        warnings = []
+        if self.invalidballots:
+            codes = sorted(self.invalidcodes.items(), key=lambda item: item[1], reverse=True)
+            listed = ', '.join(f"{code or '<empty>'} x{count}" for code, count in codes[:10])
+            more = f" and {len(codes) - 10} more" if len(codes) > 10 else ''
+            warnings.append(f"{self.invalidballots} ballots used invalid candidate codes ({listed}{more}). Ignoring")
+        if self.repeatedballots:
+            warnings.append(f"{self.repeatedballots} ballots specified a candidate more than once. Ignoring repeats")
+        return warnings
+
+
+def _read_lines(path: str) -> Iterator[List[str]]:
+    """ Lines of a text file, a block at a time """
+    with open(path, 'r') as f:
+        rest = ''
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            lines = (rest + block).split('\n')
+            rest = lines.pop()
+            yield lines
+        if rest:
+            yield [rest]
+
+
+def read_votes(path: str, codes: Iterable[str]) -> Tuple[List[Tuple[str, Tuple[str, ...]]], LoadReport]:
+    """
+    Voter ids and clean ballots of a votes file: only the given candidate codes, each once, in order of preference.
+    Every ballot shares the same code strings, looked up once per distinct code
+    """
+    starttime = time.perf_counter()
+    report = LoadReport()
+    interned = {code: code for code in codes}
+    invalidcodes = report.invalidcodes
+    ballots = []
+    for lines in _read_lines(path):
+        for line in lines:
+            line = line.strip()
+            if not line:  # Skip empty lines
+                continue
+            uid, *tokens = line.split(',')
+            try:
+                ballot = tuple([interned[token] for token in tokens])
+            except KeyError:
+                report.invalidballots += 1
+                for token in tokens:
+                    if token not in interned:
+                        invalidcodes[token] = invalidcodes.get(token, 0) + 1
+                ballot = tuple([interned[token] for token in tokens if token in interned])
+            if len(set(ballot)) != len(ballot):
+                report.repeatedballots += 1
+                ballot = tuple(dict.fromkeys(ballot))
+            ballots.append((uid, ballot))
+    report.ballots = len(ballots)
+    report.seconds = time.perf_counter() - starttime
+    return ballots, report
+
+
+class BallotSet:
+    """ Groups, candidates and ballots in file order """
+    def __init__(self):
+        self.groups: List[Tuple[str, int]] = []  # Name and seats
+        self.candidates: List[Tuple[str, str, str]] = []  # Code, name and group name
+        self.ballots: List[Tuple[str, Tuple[str, ...]]] = []  # Voter id and candidate codes
+        self.clean = False  # Ballots hold valid codes once each, so they can be added in bulk
+        self.report: Optional[LoadReport] = None
+
+    def __repr__(self):
+        return f"BallotSet({len(self.groups)} groups, {len(self.candidates)} candidates, {len(self.ballots)} ballots)"
+
+    @property
+    def totalseats(self) -> int:
+        return sum(seats for _, seats in self.groups)
+
+    @classmethod
+    def read(cls, groupsfile: str, candidatesfile: str, votesfile: str) -> 'BallotSet':
+        """ Parse the three CSV files read by the command line interface. Raises STVSetupException """
+        ballotset = cls()
+        with open(groupsfile, 'r') as f:
+            for i, line in enumerate(f, start=1):
+                line = line.strip()
+                if line:  # Skip empty lines
+                    try:
+                        groupname, seats = line.split(',')
+                        ballotset.groups.append((groupname, int(seats)))
+                    except ValueError:
+                        raise STVSetupException(f"Could not decode group at line {i}")
+
+        with open(candidatesfile, 'r') as f:
+            for i, line in enumerate(f, start=1):
+                line = line.strip()
+                if line:  # Skip empty lines
+                    try:
+                        uid, name, groupname = line.split(',')
+                        ballotset.candidates.append((uid, name, groupname))
+                    except ValueError:
+                        raise STVSetupException(f"Could not decode candidate at line {i}")
+
+        ballotset.ballots, ballotset.report = read_votes(votesfile, (code for code, _, _ in ballotset.candidates))
+        ballotset.clean = True
+        return ballotset
+
+    def fill(self, stv, seats: Optional[Dict[str, int]] = None) -> None:
+        """
+        Add groups, candidates and ballots to an empty STV, or anything with the same add methods like a CountKey.
+        seats replaces the seats of the groups it names
+        """
+        if seats is not None:
+            unknown = set(seats) - {groupname for groupname, _ in self.groups}
+            if unknown:
+                raise STVSetupException(f"Cannot set seats of unknown groups: {', '.join(sorted(unknown))}")
+        for groupname, groupseats in self.groups:
+            stv.add_group(groupname, groupseats if seats is None else seats.get(groupname, groupseats))
+        for code, name, groupname in self.candidates:
+            stv.add_candidate(code, name, groupname)
+        if self.clean:
+            stv.add_voters(self.ballots)
+        else:
+            for uid, ballot in self.ballots:
+                stv.add_voter(uid, ballot)
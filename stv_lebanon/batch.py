@@ -0,0 +1,102 @@
+"""
+Multi-district batch counts.
+Each district is a directory holding its own Groups.csv, Candidates.csv and Votes.csv. Districts are read and
+counted in worker processes and reported as soon as each one finishes. A district that fails is reported with its
+error while the others carry on.
+"""
+import json
+import multiprocessing
+import os
+import time
+from functools import partial
+from typing import List, Dict, Optional, Iterable, Iterator, NamedTuple
+
+from .ballots import BallotSet
+from .stv import create_stv
+
+DISTRICT_FILES = ('Groups.csv', 'Candidates.csv', 'Votes.csv')
+
+
+class District(NamedTuple):
+    name: str
+    directory: str
+    usegroups: Optional[bool] = None  # None follows the batch options
+    reactivation: Optional[bool] = None
+
+
+def find_districts(root: str) -> List[District]:
+    """ Every directory under root holding a Groups.csv, named by its path relative to root """
+    districts = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        if DISTRICT_FILES[0] in files:
+            name = os.path.relpath(directory, root).replace(os.sep, '/')
+            districts.append(District(os.path.basename(os.path.abspath(root)) if name == '.' else name, directory))
+    return districts
+
+
+def read_manifest(path: str) -> List[District]:
+    """
+    Districts listed in a JSON manifest: a list of objects with a name and a path relative to the manifest, and
+    optionally usegroups and reactivation
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    return [District(entry['name'], os.path.join(base, entry['path']), entry.get('usegroups'),
+                     entry.get('reactivation')) for entry in entries]
+
+
+def count_district(district: District, usegroups: bool = False, reactivation: bool = True, engine: str = 'object',
+                   aggregate: bool = False) -> dict:
+    """ Read and count one district. Any failure is returned as the record's error instead of raised """
+    record = {'district': district.name, 'directory': district.directory}
+    starttime = time.perf_counter()
+    try:
+        ballotset = BallotSet.read(*(os.path.join(district.directory, filename) for filename in DISTRICT_FILES))
+        stv = create_stv(engine, usegroups if district.usegroups is None else district.usegroups,
+                         reactivation if district.reactivation is None else district.reactivation, aggregate)
+        ballotset.fill(stv)
+        result = stv.run_to_completion()
+    except Exception as e:  # Reported with the district, so the batch goes on
+        record['error'] = f"{type(e).__name__}: {e}"
+        return record
+
+    record.update(seats=stv.totalseats, ballots=stv.ballotcount, rounds=stv.rounds,
+                  winners=[{'code': code, 'name': stv.candidates[code].name,
+                            'group': stv.candidates[code].group.name, 'wonatquota': wonatquota}
+                           for code, wonatquota in result.winners],
+                  groupseats=result.groupseats, waste=result.totalwaste, time=time.perf_counter() - starttime)
+    return record
+
+
+def batch(districts: Iterable[District], processes: Optional[int] = None, **options) -> Iterator[dict]:
+    """ Count districts on a pool of processes, yielding each record as soon as its district is done """
+    count = partial(count_district, **options)
+    if processes == 1:
+        yield from map(count, districts)
+        return
+
+    with multiprocessing.Pool(processes) as pool:
+        yield from pool.imap_unordered(count, districts)
+
+
+def summarize(results: List[dict]) -> dict:
+    """ National totals of the counted districts, with the winners and errors by district """
+    counted = sorted((r for r in results if 'error' not in r), key=lambda r: r['district'])
+    groupseats: Dict[str, int] = {}
+    for r in counted:
+        for groupname, seats in r['groupseats'].items():
+            groupseats[groupname] = groupseats.get(groupname, 0) + seats
+    ballots = sum(r['ballots'] for r in counted)
+    waste = sum(r['waste'] for r in counted)
+    return {
+        'districts': len(counted),
+        'failed': {r['district']: r['error'] for r in results if 'error' in r},
+        'seats': sum(r['seats'] for r in counted),
+        'ballots': ballots,
+        'waste': waste,
+        'wasteratio': waste / ballots if ballots else 0.0,
+        'groupseats': groupseats,
+        'winners': {r['district']: r['winners'] for r in counted},
+    }
@@ -0,0 +1,145 @@
+"""
+Content-addressed cache of count results.
+Keys hash everything that decides the outcome of a count, so the same ballot set is counted once per engine version.
+Results are kept as JSON: in a small in-memory LRU, and optionally in a directory shared between processes.
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from itertools import repeat
+from typing import Optional, Dict, Tuple, Iterable, Any
+
+ENGINE_VERSION = 1  # Bump when a change to the counting alters results, so stored results are not reused
+
+
+class CountKey:
+    """
+    Canonical hash of a count. Feed it the groups, candidates and voters in the order they are added to the STV,
+    since that order breaks ties. Candidate names do not change results and are left out, unless withnames is set for
+    results that show them
+    """
+    def __init__(self, usegroups: bool, reactivation: bool, withnames: bool = False, **options):
+        self._hash = hashlib.sha256()
+        self.withnames = withnames
+        self._feed('count', ENGINE_VERSION, bool(usegroups), bool(reactivation), sorted(options.items()))
+
+    def _feed(self, *item) -> None:
+        self._hash.update(json.dumps(item, separators=(',', ':')).encode())
+        self._hash.update(b'\n')
+
+    def add_group(self, name: str, seats: int) -> None:
+        self._feed('g', name, seats)
+
+    def add_candidate(self, code: str, name: str, groupname: str) -> None:
+        if self.withnames:
+            self._feed('c', code, name, groupname)
+        else:
+            self._feed('c', code, groupname)
+
+    def add_voter(self, uid: str, ballot: Iterable[str], multiplicity: int = 1) -> None:
+        if multiplicity == 1:
+            self._feed('v', uid, list(ballot))
+        else:
+            self._feed('v', uid, list(ballot), multiplicity)
+
+    def add_voters(self, voters: Iterable[Tuple[str, Iterable[str]]],
+                   multiplicities: Optional[Iterable[int]] = None) -> None:
+        for (uid, ballot), multiplicity in zip(voters, repeat(1) if multiplicities is None else multiplicities):
+            self.add_voter(uid, ballot, multiplicity)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU of results by key. With a directory, results are also written there as files and read back on a miss.
+    Files are evicted least recently used first once the directory holds more than maxbytes
+    """
+    def __init__(self, maxentries: int = 32, directory: Optional[str] = None, maxbytes: int = 64 * 2 ** 20):
+        self.maxentries = maxentries
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self._entries: 'OrderedDict[str, str]' = OrderedDict()  # Serialized, so callers cannot alter stored results
+
+        self.hits = 0
+        self.diskhits = 0  # Part of hits
+        self.misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> Optional[Any]:
+        """ Stored result, or None """
+        text = self._entries.get(key)
+        if text is not None:
+            self._entries.move_to_end(key)
+        elif self.directory is not None:
+            path = self._path(key)
+            try:
+                with open(path) as f:
+                    text = f.read()
+                os.utime(path)  # Recently used files are evicted last
+            except OSError:
+                pass
+            else:
+                self.diskhits += 1
+                self._remember(key, text)
+
+        if text is None:
+            self.misses += 1
+            return None
+        try:
+            value = json.loads(text)
+        except ValueError:  # File cut short by a crash. Count again
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        text = json.dumps(value, separators=(',', ':'))
+        self._remember(key, text)
+        if self.directory is not None:
+            path = self._path(key)
+            temppath = f'{path}.{os.getpid()}.tmp'
+            with open(temppath, 'w') as f:
+                f.write(text)
+            os.replace(temppath, path)  # Readers never see a partial file
+            self._evict_files()
+
+    def _remember(self, key: str, text: str) -> None:
+        self._entries[key] = text
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxentries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.json')
+
+    def _evict_files(self) -> None:
+        files = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.json'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:  # Evicted by another process
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(filesize for _, filesize, _ in files)
+        for _, filesize, path in sorted(files):
+            if size <= self.maxbytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= filesize
+
+    def statistics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'diskhits': self.diskhits, 'misses': self.misses, 'entries': len(self._entries),
+                'hitrate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,51 @@
+"""
+Checkpoints of counts in progress.
+A checkpoint is an STV snapshot, pickled and compressed. It replaces the previous one only once fully written, so a
+count killed at any time can go on from its last checkpoint with STV.start(resume=True).
+"""
+import os
+import pickle
+import time
+import zlib
+from typing import Generator, Iterable
+
+from .stv import STV, STVStatus, STVSetupException
+
+CHECKPOINT_INTERVAL = 60.0  # Seconds between automatic checkpoints
+COMPRESSION_LEVEL = 1  # Weights barely compress further. Keeps saving fast
+
+
+def save_checkpoint(stv: STV, path: str) -> None:
+    """ Write a checkpoint of stv, which must be suspended at a yield of start() """
+    data = zlib.compress(pickle.dumps(stv.snapshot(), pickle.HIGHEST_PROTOCOL), COMPRESSION_LEVEL)
+    temppath = f'{path}.{os.getpid()}.tmp'
+    with open(temppath, 'wb') as f:
+        f.write(data)
+    os.replace(temppath, path)  # The previous checkpoint stays until this one is complete
+
+
+def load_checkpoint(path: str) -> STV:
+    """ Rebuild the count saved at path. Raises STVSetupException if the file is not a checkpoint """
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        snapshot = pickle.loads(zlib.decompress(data))
+    except (zlib.error, pickle.UnpicklingError, EOFError) as e:
+        raise STVSetupException(f"{path} is not a checkpoint: {e}")
+    if not isinstance(snapshot, dict):
+        raise STVSetupException(f"{path} is not a checkpoint")
+    return STV.from_snapshot(snapshot)
+
+
+def checkpointed(stv: STV, statuses: Iterable[STVStatus], path: str,
+                 interval: float = CHECKPOINT_INTERVAL) -> Generator[STVStatus, None, None]:
+    """
+    Pass on the statuses of stv.start(), saving a checkpoint before passing one on whenever interval seconds went by
+    since the last. Nothing is saved once the count is finished
+    """
+    lastsave = time.monotonic()
+    for status in statuses:
+        if status.yieldlevel != STVStatus.END and time.monotonic() - lastsave >= interval:
+            save_checkpoint(stv, path)
+            lastsave = time.monotonic()
+        yield status
@@ -1,7 +1,18 @@
 import argparse
+import json
+import os
 import sys
+import time
+from typing import List, Optional, Union
 from importlib import resources
-from .stv import STV, STVStatus, STVSetupException
+from .stv import STV, Candidate, STVStatus, STVResult, STVSetupException, ENGINES, create_stv
+from .cache import CountKey, ResultCache
+from .ballots import BallotSet
+from .sweep import scenario_grid, sweep, format_table
+from .batch import find_districts, read_manifest, batch, summarize
+from .resample import BallotStore, bootstrap
+from .ballotfile import BallotFile, write_ballot_file
+from .checkpoint import CHECKPOINT_INTERVAL, load_checkpoint, checkpointed
 
 
 def main() -> None:
@@ -11,13 +22,90 @@ def main() -> None:
     parser.add_argument('-l', dest='level', type=int, default=0, help="Level of monitoring. 1=Round 2=Subround 3=Loop")
     parser.add_argument('-w', dest='watch', default="", metavar="VOTERID", help="View Voter Situation at every round")
     parser.add_argument('-s', dest='sample', action='store_true', help="Load sample data")
+    parser.add_argument('-a', dest='aggregate', action='store_true', help="Count identical ballots once")
+    parser.add_argument('-e', dest='engine', default='object', choices=ENGINES, help="Counting engine")
+    parser.add_argument('-x', dest='acceleration', type=float, default=None, metavar="TOLERANCE",
+                        help="Accelerate convergence of surplus transfers by extrapolating thresholds")
+    parser.add_argument('-b', dest='ballotfile', default=None, metavar="FILE",
+                        help="Load a binary ballot file made by the convert command instead of the CSV files")
+    parser.add_argument('-c', dest='cachedir', default=None, metavar="DIRECTORY",
+                        help="Reuse final results stored in this directory when counting the same ballots again")
+    parser.add_argument('-k', dest='checkpoint', default=None, metavar="FILE",
+                        help="Save the count in progress to this file regularly. If it exists, go on from it instead. "
+                             "Without a voter to watch, checkpoints are only taken between subrounds")
+    parser.add_argument('--profile', action='store_true',
+                        help="Print timings and counters of the count at the end. Skips the result cache")
+    parser.add_argument('--every', dest='interval', type=float, default=CHECKPOINT_INTERVAL, metavar="SECONDS",
+                        help=f"Seconds between checkpoints. Default {CHECKPOINT_INTERVAL:g}")
+    subparsers = parser.add_subparsers(dest='command', metavar="COMMAND")
+    sweepparser = subparsers.add_parser('sweep', help="Compare results with and without -g and -n, and with other seats")
+    sweepparser.add_argument('-S', dest='seats', action='append', default=[], metavar="NAME=GROUP:SEATS,...",
+                             help="Also count with these seats. Groups left out keep their seats. Repeatable")
+    sweepparser.add_argument('-p', dest='processes', type=int, default=None,
+                             help="Worker processes. One per CPU by default")
+    sweepparser.add_argument('-o', dest='output', default=None, metavar="FILE", help="Write results as JSON")
+    batchparser = subparsers.add_parser('batch', help="Count many districts in parallel")
+    batchparser.add_argument('districts', metavar="PATH",
+                             help="Directory searched for district directories, or a JSON manifest of districts")
+    batchparser.add_argument('-p', dest='processes', type=int, default=None,
+                             help="Worker processes. One per CPU by default")
+    batchparser.add_argument('-o', dest='output', default=None, metavar="FILE",
+                             help="Write the national summary as JSON")
+    convertparser = subparsers.add_parser('convert', help="Write the CSV files as one binary ballot file")
+    convertparser.add_argument('output', metavar="FILE", help="Binary ballot file to write")
+    convertparser.add_argument('-a', dest='aggregate', action='store_true',
+                               help="Store identical ballots once with their count. Keeps the first voter id")
+    bootstrapparser = subparsers.add_parser('bootstrap', help="Win probabilities over resampled ballots")
+    bootstrapparser.add_argument('-r', dest='resamples', type=int, default=1000, help="Number of resamples")
+    bootstrapparser.add_argument('--seed', type=int, default=0, help="Seed of the first resample")
+    bootstrapparser.add_argument('-p', dest='processes', type=int, default=None,
+                                 help="Worker processes. One per CPU by default")
+    bootstrapparser.add_argument('-o', dest='output', default=None, metavar="FILE", help="Write results as JSON")
     parser_result = parser.parse_args()
 
+    if parser_result.command == 'sweep':
+        run_sweep(parser_result)
+        return
+    elif parser_result.command == 'batch':
+        run_batch(parser_result)
+        return
+    elif parser_result.command == 'convert':
+        ballotset = load(parser_result.sample)
+        write_ballot_file(ballotset, parser_result.output, parser_result.aggregate)
+        print(f"Wrote {len(ballotset.ballots):,} ballots to {parser_result.output} "
+              f"({os.path.getsize(parser_result.output):,} bytes)")
+        return
+    elif parser_result.command == 'bootstrap':
+        run_bootstrap(parser_result)
+        return
+
     use_groups: bool = parser_result.group
     reactivation: bool = parser_result.reactivation
     viewlevel: int = min(max(parser_result.level, 0), 3) + 1  # So it matches STVStatus levels
     viewvoter: str = parser_result.watch
     load_samples: bool = parser_result.sample
+    aggregate: bool = parser_result.aggregate
+    engine: str = parser_result.engine
+    acceleration: Optional[float] = parser_result.acceleration
+    cachedir: Optional[str] = parser_result.cachedir
+    checkpoint: Optional[str] = parser_result.checkpoint
+    profile: bool = parser_result.profile
+
+    stv = None
+    if checkpoint is not None:
+        if engine != 'object':
+            print("\nError: Checkpoints are only available with the object engine")
+            sys.exit(1)
+        if os.path.exists(checkpoint):
+            try:
+                stv = load_checkpoint(checkpoint)
+            except (OSError, STVSetupException) as e:
+                print(f"\nError: Could not resume from checkpoint '{checkpoint}': {e}")
+                sys.exit(1)
+            use_groups, reactivation, aggregate, acceleration = (stv.usegroups, stv.reactivationmode, stv.aggregate,
+                                                                 stv.acceleration)
+            print(f"Resuming from checkpoint '{checkpoint}' at round {stv.rounds}.{stv.subrounds}. "
+                  "Counting options are those of the checkpoint\n")
 
     print("Use -h to see running options\n")
     print("Groups:", use_groups)
@@ -25,16 +113,62 @@ def main() -> None:
     print("View Level:", {STVStatus.END: "Result", STVStatus.ROUND: "Round", STVStatus.SUBROUND: "Subround",
                           STVStatus.LOOP: "Loop"}[viewlevel])
     print("Watching:", viewvoter or "<None>")
+    print("Aggregate:", aggregate)
+    print("Engine:", engine)
+    print("Acceleration:", "<None>" if acceleration is None else f"Tolerance {acceleration}")
+
+    resume = stv is not None
+    countkey = None
+    # Only the final summary is cached. Profiles are of the count at hand
+    if cachedir is not None and viewlevel == STVStatus.END and not resume and not profile:
+        countkey = CountKey(use_groups, reactivation, engine=engine, aggregate=aggregate, acceleration=acceleration)
+    if not resume:
+        stv = setup(use_groups, reactivation, load_samples, aggregate, engine, acceleration, countkey,
+                    parser_result.ballotfile)
 
-    stv = setup(use_groups, reactivation, load_samples)
+    if profile:
+        stv.enable_profiling()
 
     if viewvoter and viewvoter not in stv.voters:
         print(f"\nWarning: Could not find Voter with ID: {viewvoter}")
         viewvoter = ""
 
-    print(f"\nSeats: {stv.totalseats}\nTotal Votes: {len(stv.voters)}  Quota: {formatvote(stv.quota)}\n")
-    
-    for status in stv.start():
+    print(f"\nSeats: {stv.totalseats}\nTotal Votes: {stv.ballotcount}  Quota: {formatvote(stv.quota)}\n")
+
+    if viewlevel == STVStatus.END and not viewvoter:  # Nothing to watch. Skip intermediate states
+        cache = ResultCache(directory=cachedir) if countkey is not None else None
+        cached = cache.get(countkey.hexdigest()) if cache is not None else None
+        if cached is None:
+            finalstatus = None
+            if checkpoint is not None:  # Subrounds are often enough to checkpoint at, without the cost of loop yields
+                statuses = checkpointed(stv, stv.start(STVStatus.SUBROUND, resume), checkpoint,
+                                        parser_result.interval)
+            else:
+                statuses = stv.start(STVStatus.END)
+            for finalstatus in statuses:
+                pass
+            result = stv.result()
+            if cache is not None:
+                cache.put(countkey.hexdigest(), result.asdict())
+            if finalstatus is not None:
+                print_excluded(finalstatus.excluded_by_group)
+            print_lists(stv, viewvoter)
+        else:  # Vote totals of the other candidates and the last exclusions are not stored
+            result = STVResult.fromdict(cached)
+            print_winners(stv, result)
+        print("---------------------------\n")
+        print_result(stv, result)
+        if cache is not None:
+            stats = cache.statistics()
+            print("Cache:", "hit" if cached is not None else "miss", f"({stats['hits']} hits, {stats['misses']} misses)")
+        print_profile(stv)
+        remove_checkpoint(checkpoint)
+        return
+
+    statuses = stv.start(viewlevel, resume)
+    if checkpoint is not None:
+        statuses = checkpointed(stv, statuses, checkpoint, parser_result.interval)
+    for status in statuses:
         if status.yieldlevel <= viewlevel and status.yieldlevel != status.BEGIN:
             if status.yieldlevel == status.INITIAL:
                 print("Initial Round\n")
@@ -49,13 +183,11 @@ def main() -> None:
                     print("Allocations:", stv.allocationcount)
                 elif stv.reductioncount > 0:
                     print("Reductions:", stv.reductioncount)
+                if stv.estimatedsavedloops > 0:
+                    print("Estimated loops saved by acceleration:", stv.estimatedsavedloops)
                 print()
 
-            if status.excluded_by_group:
-                print("The following candidates have been excluded because their group quota has been met:")
-                for c in status.excluded_by_group:
-                    print(c.name)
-                print()
+            print_excluded(status.excluded_by_group)
 
             if status.reactivated:
                 print("The following candidates have been returned to the active list:")
@@ -74,14 +206,130 @@ def main() -> None:
                     sys.exit()
                 print()
             else:
-                print("Votes Finished")
-                for group in stv.groups.values():
-                    print(group.name, group.seatswon, '/', group.seats)
-                print("Waste Percentage:", formatratio(stv.totalwaste / len(stv.voters)))
+                print_result(stv, stv.result())
+    print_profile(stv)
+    remove_checkpoint(checkpoint)
+
+
+def run_sweep(parser_result: argparse.Namespace) -> None:
+    """ Count the scenario grid of the sweep command and print the comparison """
+    seatconfigs = {}
+    for config in parser_result.seats:
+        try:
+            seatsname, allocation = config.split('=')
+            seatconfigs[seatsname] = {groupname: int(seats) for groupname, seats in
+                                      (item.split(':') for item in allocation.split(','))}
+        except ValueError:
+            print(f"Error: Could not decode seats '{config}'. Expected NAME=GROUP:SEATS,...")
+            sys.exit(1)
+
+    ballotset = load(parser_result.sample)
+    scenarios = scenario_grid(seatconfigs)
+    print(f"Counting {len(scenarios)} scenarios of {len(ballotset.ballots)} ballots\n")
+    results = list(sweep(ballotset, scenarios, parser_result.processes, parser_result.engine,
+                         parser_result.aggregate))
+    print(format_table(results))
+
+    if parser_result.output:
+        with open(parser_result.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def run_batch(parser_result: argparse.Namespace) -> None:
+    """ Count the districts of the batch command, printing each as it finishes, then the national summary """
+    if os.path.isdir(parser_result.districts):
+        districts = find_districts(parser_result.districts)
+    else:
+        try:
+            districts = read_manifest(parser_result.districts)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Error: Could not read manifest '{parser_result.districts}': {e}")
+            sys.exit(1)
+    print(f"Counting {len(districts)} districts\n")
+
+    results = []
+    for r in batch(districts, parser_result.processes, usegroups=parser_result.group,
+                   reactivation=parser_result.reactivation, engine=parser_result.engine,
+                   aggregate=parser_result.aggregate):
+        results.append(r)
+        if 'error' in r:
+            print(f"{r['district']:<24}failed: {r['error']}")
+        else:
+            print(f"{r['district']:<24}{r['ballots']:>9} ballots {r['seats']:>4} seats  "
+                  f"{formatratio(r['waste'] / r['ballots'] if r['ballots'] else 0)} waste  "
+                  f"{', '.join(w['name'] for w in r['winners'])}")
+
+    summary = summarize(results)
+    print("\n---------------------------\n")
+    print(f"Districts: {summary['districts']} counted, {len(summary['failed'])} failed")
+    print(f"Seats: {summary['seats']}  Ballots: {summary['ballots']}  "
+          f"Waste Percentage: {formatratio(summary['wasteratio'])}")
+    for groupname, seats in sorted(summary['groupseats'].items()):
+        print(formatname(groupname), seats)
+
+    if parser_result.output:
+        with open(parser_result.output, 'w') as f:
+            json.dump(dict(summary, results=sorted(results, key=lambda r: r['district'])), f, indent=2)
+    if summary['failed']:
+        sys.exit(1)
+
+
+def run_bootstrap(parser_result: argparse.Namespace) -> None:
+    """ Count the resamples of the bootstrap command and print win probabilities """
+    store = BallotStore(load(parser_result.sample))
+    print(f"Counting {parser_result.resamples} resamples of {store.ballotcount} ballots "
+          f"({len(store.ballots)} distinct)\n")
+    analysis = bootstrap(store, parser_result.resamples, parser_result.seed, parser_result.processes,
+                         parser_result.group, parser_result.reactivation, parser_result.engine)
 
+    print(formatname('Candidate') + '  ' + formatname('Group') + '  Wins   95% Interval')
+    for c in sorted(analysis['candidates'].values(), key=lambda c: c['probability'], reverse=True):
+        print(formatname(c['name']) + ('W ' if c['winner'] else '  ') + formatname(c['group']),
+              formatratio(c['probability']), f"  {formatratio(c['low'])} - {formatratio(c['high'])}")
 
-def setup(usegroups: bool, reactivationmode: bool, load_samples: bool = False) -> STV:
-    """ Import from local files, create and return STV instance """
+    if parser_result.output:
+        with open(parser_result.output, 'w') as f:
+            json.dump(analysis, f, indent=2)
+
+
+def remove_checkpoint(checkpoint: Optional[str]) -> None:
+    """ A finished count needs no checkpoint. The next run with the same file starts over """
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+def setup(usegroups: bool, reactivationmode: bool, load_samples: bool = False, aggregate: bool = False,
+          engine: str = 'object', acceleration: Optional[float] = None, countkey: Optional[CountKey] = None,
+          ballotfile: Optional[str] = None) -> STV:
+    """
+    Import from local files, or from a binary ballot file, create and return STV instance.
+    countkey is fed the same input when given
+    """
+    starttime = time.perf_counter()
+    if ballotfile is not None:
+        try:
+            source: Union[BallotSet, BallotFile] = BallotFile(ballotfile)
+        except (OSError, ValueError, STVSetupException) as e:
+            print(f"\nError: Could not open ballot file '{ballotfile}': {e}")
+            sys.exit(1)
+    else:
+        source = load(load_samples)
+    try:
+        stv = create_stv(engine, usegroups, reactivationmode, aggregate, acceleration)
+        source.fill(stv)
+        if countkey is not None:
+            source.fill(countkey)
+    except STVSetupException as e:
+        print("\nSetup Error:", e)
+        sys.exit(1)
+    seconds = time.perf_counter() - starttime
+    print(f"Loaded {stv.ballotcount:,} ballots in {seconds:.2f}s "
+          f"({stv.ballotcount / seconds if seconds else 0:,.0f} ballots per second)")
+    return stv
+
+
+def load(load_samples: bool = False) -> BallotSet:
+    """ Parse the local files, or the samples, once """
 
     def local_or_sample(filename: str) -> str:
         if load_samples:
@@ -90,38 +338,12 @@ def setup(usegroups: bool, reactivationmode: bool, load_samples: bool = False) -
             print("Using sample:", filename)
         return filename
 
-    stv = STV(usegroups, reactivationmode)
     try:
-        # Fill Objects
-        with open(local_or_sample('Groups.csv'), 'r') as f:
-            for i, line in enumerate(f, start=1):
-                line = line.strip()  # Skip empty lines
-                try:
-                    groupname, seats = line.split(',')
-                    stv.add_group(groupname, int(seats))
-                except ValueError:
-                    raise STVSetupException(f"Could not decode group at line {i}")
-
-        with open(local_or_sample('Candidates.csv'), 'r') as f:
-            for i, line in enumerate(f, start=1):
-                line = line.strip()
-                if line:  # Skip empty lines
-                    try:
-                        uid, name, groupname = line.split(',')
-                        stv.add_candidate(uid, name, groupname)
-                    except ValueError:
-                        raise STVSetupException(f"Could not decode candidate at line {i}")
-
-        with open(local_or_sample('Votes.csv'), 'r') as f:
-            for i, line in enumerate(f, start=1):
-                line = line.strip()
-                if line:  # Skip empty lines
-                    try:
-                        uid, *ballot = line.split(',')
-                        stv.add_voter(uid, ballot)
-                    except ValueError:
-                        print("Setup Warning: Could not decode voter at line", i)
-
+        ballotset = BallotSet.read(local_or_sample('Groups.csv'), local_or_sample('Candidates.csv'),
+                                   local_or_sample('Votes.csv'))
+        for warning in ballotset.report.warnings():
+            print("Setup Warning:", warning)
+        return ballotset
     except (FileNotFoundError, STVSetupException) as e:
         if isinstance(e, FileNotFoundError):
             print(f"\nError: Missing file '{e.filename}'. Please make sure you have the following 3 files in your "
@@ -129,7 +351,6 @@ def setup(usegroups: bool, reactivationmode: bool, load_samples: bool = False) -
         else:
             print("\nSetup Error:", e)
         sys.exit(1)
-    return stv
 
 
 def print_lists(stv: STV, voterid: str) -> None:
@@ -144,7 +365,7 @@ def print_lists(stv: STV, voterid: str) -> None:
 
     if voterid:  # If not empty string. Already checked after setup
         voter = stv.voters[voterid]
-        print('\n' + voter.uid, 'list:')
+        print('\n' + voterid, 'list:')
         for vl in voter.votelinks:
             statusdescription = {vl.EXCLUDED: 'Excluded', vl.DEACTIVATED: 'Deactivated', vl.ACTIVE: 'Active',
                                  vl.PARTIAL: 'Partial', vl.FULL: 'Full'}[vl.status]
@@ -152,6 +373,38 @@ def print_lists(stv: STV, voterid: str) -> None:
         print(formatname('Waste'), formatratio(voter.waste))
 
 
+def print_winners(stv: STV, result: STVResult) -> None:
+    """ Prints winners of a stored result with the votes each won at """
+    for code, wonatquota in result.winners:
+        print(formatname(stv.candidates[code].name) + 'W', formatvote(wonatquota))
+    print('------------')
+    print(formatname('Total Waste') + ' ', formatvote(result.totalwaste))
+
+
+def print_result(stv: STV, result: STVResult) -> None:
+    """ Prints group seats and waste of a finished count """
+    print("Votes Finished")
+    for groupname, seatswon in result.groupseats.items():
+        print(groupname, seatswon, '/', stv.groups[groupname].seats)
+    print("Waste Percentage:", formatratio(result.totalwaste / stv.ballotcount))
+
+
+def print_excluded(candidates: List[Candidate]) -> None:
+    """ Prints the candidates a decision excluded by group quota, if any """
+    if candidates:
+        print("The following candidates have been excluded because their group quota has been met:")
+        for c in candidates:
+            print(c.name)
+        print()
+
+
+def print_profile(stv: STV) -> None:
+    """ Prints the profile of a count, if it was profiled """
+    if stv.profile is not None:
+        print("\nProfile")
+        print(stv.profile.summary())
+
+
 def formatname(v):
     return '{:<20}'.format(v)
 
@@ -0,0 +1,169 @@
+"""
+Incremental counts for results that come in batches, like ballots from polling stations on election night.
+Each batch is added to the finished count of the previous ones, which is brought to the fixed point of all ballots
+from its converged weights instead of being counted again from the first round. This warm start keeps every decision
+of the last full count, so it is only used while the new ballots cannot have changed them:
+- Every decision of the full count is kept with the totals it was taken on. New ballots are spread over the
+  candidates the way that round would have: winners keep their share and pass the rest on, lost candidates are passed
+  over. Losers must stay behind every candidate in the running that did not lose in the same run of losses, nobody
+  may reach the quota before a loss, and winners at the quota must still reach it. Only the first order effect of new
+  ballots is counted: surplus shifting because winners keep a little less of each ballot as the quota grows is left
+  out.
+- Once warm started, winners keep the kind of win they had and no candidate left in the running reaches the quota.
+Otherwise all ballots are counted again from the start. Winners keep the order of the last full count, and totals
+may differ slightly from a full count of the same ballots. final() forces a full count.
+Warm starts rarely qualify on small counts, where a batch moves totals by more than the gaps between candidates.
+Every batch is then a full count, slightly slower than counting without IncrementalCount.
+"""
+import time
+from typing import List, Dict, Tuple, Optional, Iterable, NamedTuple, FrozenSet
+
+from .stv import STV, STVResult, STVStatus, STVSetupException, MIN_TRANSFER, VOTES_PRECISION
+
+
+class Provisional(NamedTuple):
+    result: STVResult
+    ballots: int
+    warm: bool  # Warm start from the previous count. False after a full count
+    seconds: float
+
+
+class Decision(NamedTuple):
+    """ A win at the quota or a loss of a full count, with what it was taken on """
+    winner: Optional[str]  # Code of the candidate elected at the quota. None for a loss
+    loser: Optional[str]
+    votes: Dict[str, float]  # Totals of the candidates in the running, before the decision
+    keep: Dict[str, float]  # Weight each winner kept from its supporters. Passed on beyond it
+    lostwith: FrozenSet[str]  # Losers of the same run of losses. Losing in another order, the run ends the same
+
+    def spread(self, ballot: Iterable[str], shift: Dict[str, float]) -> None:
+        """ Add the votes a new ballot would have given the candidates in the running """
+        remaining = 1.0
+        for code in ballot:
+            if code in self.keep:
+                remaining -= min(remaining, self.keep[code])
+                if remaining <= MIN_TRANSFER:
+                    return
+            elif code in self.votes:
+                shift[code] = shift.get(code, 0) + remaining
+                return
+
+    def stands(self, shift: Dict[str, float], quota: float) -> bool:
+        """ Whether the decision is still taken with the shifted totals and the new quota """
+        quota = round(quota, VOTES_PRECISION)
+        if self.winner is not None:
+            return round(self.votes[self.winner] + shift.get(self.winner, 0), VOTES_PRECISION) >= quota
+        loservotes = self.votes[self.loser] + shift.get(self.loser, 0)
+        for code, votes in self.votes.items():
+            newvotes = votes + shift.get(code, 0)
+            if round(newvotes, VOTES_PRECISION) >= quota:
+                return False
+            gap = round(newvotes - loservotes, VOTES_PRECISION)
+            if (gap <= 0 and gap != round(votes - self.votes[self.loser], VOTES_PRECISION)
+                    and code not in self.lostwith):
+                return False
+        return True
+
+
+class IncrementalCount:
+    """ Ballots added batch by batch, with the result of all ballots so far after each batch """
+    def __init__(self, groups: List[Tuple[str, int]], candidates: List[Tuple[str, str, str]], usegroups: bool = False,
+                 reactivation: bool = True, aggregate: bool = False, acceleration: Optional[float] = None):
+        self.groups = groups  # Name and seats
+        self.candidates = candidates  # Code, name and group name
+        self.options = (usegroups, reactivation, aggregate, acceleration)
+        self.ballots: List[Tuple[str, Tuple[str, ...]]] = []  # Every ballot so far, for full counts
+        self.stv: Optional[STV] = None  # Finished count of every ballot so far
+        self.warm = False  # Whether the current count comes from a warm start
+        self.warmstarts = 0
+        self.recounts = 0
+        self.decisions: List[Decision] = []  # Of the last full count
+        self.shifts: List[Dict[str, float]] = []  # Votes added to each decision since the last full count
+        self._codes = {code for code, _, _ in candidates}
+
+    def add_batch(self, ballots: Iterable[Tuple[str, Tuple[str, ...]]]) -> Provisional:
+        """
+        Add clean ballots, like those of BallotSet.read, and return the result of all ballots so far.
+        Raises STVSetupException before adding anything if a voter id repeats or a code is not a candidate
+        """
+        batch = list(ballots)
+        uids = {uid for uid, _ in batch}
+        if len(uids) != len(batch) or '' in uids or (self.stv is not None and not uids.isdisjoint(self.stv.voters)):
+            raise STVSetupException("Batch has empty or already added voter ids")
+        for uid, ballot in batch:
+            if not self._codes.issuperset(ballot) or len(set(ballot)) != len(ballot):
+                raise STVSetupException(f"Voter {uid} does not have a clean ballot")
+
+        starttime = time.perf_counter()
+        self.ballots.extend(batch)
+        self.warm = self.stv is not None and self._warm_start(batch)
+        if self.warm:
+            self.warmstarts += 1
+        else:
+            self._recount()
+        return Provisional(self.stv.result(), self.stv.ballotcount, self.warm, time.perf_counter() - starttime)
+
+    def final(self) -> STVResult:
+        """ Result of a full count of all ballots so far. Counts again only after a warm start """
+        if self.stv is None or self.warm:
+            self._recount()
+            self.warm = False
+        return self.stv.result()
+
+    def _warm_start(self, batch: List[Tuple[str, Tuple[str, ...]]]) -> bool:
+        """ Add the batch to the finished count and converge again. False if a decision may not stand anymore """
+        stv = self.stv
+        quota = (stv.ballotcount + len(batch)) / stv.totalseats
+        for decision, shift in zip(self.decisions, self.shifts):
+            for _, ballot in batch:
+                decision.spread(ballot, shift)
+            if not decision.stands(shift, quota):
+                return False
+
+        previousquota = stv.quota
+        atquota = {w for w in stv.winners
+                   if round(w.wonatquota, VOTES_PRECISION) >= round(previousquota, VOTES_PRECISION)}
+        stv.add_voters(batch)
+        stv.reconverge(previousquota)
+
+        quota = round(stv.quota, VOTES_PRECISION)
+        return (all((w.roundedvotes >= quota) == (w in atquota) for w in stv.winners)
+                and all(c.roundedvotes < quota for c in stv.active))
+
+    def _recount(self) -> None:
+        """ Count all ballots from the start, keeping each decision with the totals it was taken on """
+        stv = STV(*self.options)
+        for groupname, seats in self.groups:
+            stv.add_group(groupname, seats)
+        for code, name, groupname in self.candidates:
+            stv.add_candidate(code, name, groupname)
+        stv.add_voters(self.ballots)
+
+        decisions = []  # Everything of each Decision but lostwith
+        runs: List[List[int]] = [[]]  # Runs of losses ended by a win or a reactivation, as indexes in decisions
+        quota = round(stv.quota, VOTES_PRECISION)
+        for status in stv.start(STVStatus.SUBROUND):  # Weights are as before the decision when it is yielded
+            decided = status.winner or status.loser
+            if decided is None:
+                continue
+            # Seats filled below the quota only depend on how many candidates are left, so they are not kept
+            if status.winner is None or round(decided.wonatquota, VOTES_PRECISION) >= quota:
+                running = [decided] + status.excluded_by_group
+                running += [c for c in stv.active if c not in (status.reactivated or ())]
+                keep = {w.code: w.fullvls[0].weight if w.fullvls else 1.0 for w in stv.winners if w is not decided}
+                decisions.append((status.winner and status.winner.code, status.loser and status.loser.code,
+                                  {c.code: c.votes for c in running}, keep))
+                if status.loser is not None:
+                    runs[-1].append(len(decisions) - 1)
+            if status.winner is not None or status.reactivated:
+                runs.append([])
+
+        lostwith = [frozenset()] * len(decisions)
+        for run in runs:
+            losers = frozenset(decisions[i][1] for i in run)
+            for i in run:
+                lostwith[i] = losers
+        self.decisions = [Decision(*decision, losers) for decision, losers in zip(decisions, lostwith)]
+        self.shifts = [{} for _ in self.decisions]
+        self.stv = stv
+        self.recounts += 1
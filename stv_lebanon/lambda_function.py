@@ -1,13 +1,38 @@
-from typing import Optional
+import json
+from typing import Optional, Tuple, Generator
 from os import getenv
+from time import monotonic
 
-from .stv import STV
-from .stv_progress import STVProgress, Position
+from .stv import STV, STVStatus, create_stv, STVSetupException
+from .stv_progress import STVProgress, Position, VoterTrajectory, KEYFRAME_INTERVAL
+from .cache import CountKey, ResultCache
 
-VOTES_LIMIT = int(getenv('VOTES_LIMIT', 50))
+VOTES_LIMIT = int(getenv('VOTES_LIMIT', 5000))
+TIME_BUDGET = float(getenv('TIME_BUDGET', 20))  # Seconds of counting before answering with what is known
+MEMORY_BUDGET = int(getenv('MEMORY_BUDGET', 256)) * 2 ** 20  # Bytes held by the progress and the response
+# Warm invocations reuse the container, so recounts of the same event are answered from memory or CACHE_DIR
+RESULT_CACHE = ResultCache(int(getenv('CACHE_ENTRIES', 32)), getenv('CACHE_DIR'), int(getenv('CACHE_MB', 64)) * 2 ** 20)
+LINK_NAMES = ('nextRound', 'nextSubround', 'previousRound', 'previousSubround')
 
+# From most to least detailed. loopsummary leaves out the candidates of loops that decide nothing
+DETAIL_LEVELS = ('loop', 'loopsummary', 'subround', 'round', 'result')
+POSITION_LEVELS = {'loop': STVStatus.LOOP, 'loopsummary': STVStatus.LOOP, 'subround': STVStatus.SUBROUND,
+                   'round': STVStatus.ROUND}
 
-def pos_to_json(pos: Position, initquota: float, winners_quota: dict, viewvoter: Optional[str]):
+# Cost model, fitted on the synthetic elections of benchmarks.generators
+DECISIONS_PER_CANDIDATE = 2.5  # Wins and exclusions, counting those undone by reactivation
+LOOPS_PER_DECISION = 3.5
+COUNT_SECONDS = 1.2e-7  # Per counted ballot entry and loop
+PROGRESS_SECONDS = 6e-7  # Per ballot entry and recorded position
+ENTRY_BYTES = 400  # Voters, vote links and the first snapshot, per ballot entry
+KEYFRAME_BYTES = 250  # Per ballot entry and keyframe
+CHANGE_SHARE = 0.1  # Share of ballot entries changing between positions
+CHANGE_BYTES = 120
+CANDIDATE_BYTES = 400  # One candidate of one loop in the response
+
+
+def pos_to_json(pos: Position, initquota: float, winners_quota: dict, viewtrajectory: Optional[VoterTrajectory],
+                withcandidates: bool = True):
     j = {
         'round': pos.round,
         'subround': pos.subround,
@@ -16,94 +41,232 @@ def pos_to_json(pos: Position, initquota: float, winners_quota: dict, viewvoter:
         'message': pos.message,
         'candidates': {},
         'viewballot': None,
-        'waste': round(sum(pos.waste.values()), 2)
+        'waste': round(pos.totalwaste, 2)
     }
     for status, candlist in [('winner', pos.winners), ('active', pos.active), ('deactivated', pos.deactivated),
                              ('excluded', pos.excluded)]:
+        if not withcandidates:
+            j['candidates'] = None
+            break
         for cand in candlist:
             quota = round(winners_quota[cand.code] if status == 'winner' else initquota, 2)
             j['candidates'][cand.code] = {'votes': round(cand.votes, 2), 'status': status, 'quota': quota}
 
-    if viewvoter is not None:
+    if viewtrajectory is not None:
         j['viewballot'] = []
-        for vf in pos.votefractions.values():
-            if vf.voterid == viewvoter:
-                ballotline = {'ccode': vf.candidatecode, 'fraction': round(vf.fraction, 2), 'status': vf.status[0]}
-                j['viewballot'].append(ballotline)
+        for vf in viewtrajectory.fractions(pos.index):
+            ballotline = {'ccode': vf.candidatecode, 'fraction': round(vf.fraction, 2), 'status': vf.status[0]}
+            j['viewballot'].append(ballotline)
 
     return j
 
 
-def lambda_handler(event, context):
+def setup_stv(event) -> Tuple[Optional[STV], Optional[dict]]:
+    """ Create and fill the STV described by the event. Returns it, or an error response """
     # Preliminary checks
     usegroups = event['usegroups']
     reactivation = event['reactivation']
     groups = event['groups']
     candidates = event['candidates']
     votes = event['votes']
-    viewvoter = event.get('viewvoter')
+    aggregate = event.get('aggregate', False)
+    engine = event.get('engine', 'object')
+    acceleration = event.get('acceleration')
 
     if len(votes) > VOTES_LIMIT:
-        return get_error('Function', 'limit is {} votes'.format(VOTES_LIMIT))
+        return None, get_error('Function', 'limit is {} votes'.format(VOTES_LIMIT))
+
+    try:
+        stv = create_stv(engine, usegroups, reactivation, aggregate, acceleration)
+
+        for group in groups:
+            stv.add_group(group['name'], group['seats'])
+
+        for candidate in candidates:
+            stv.add_candidate(candidate['code'], candidate['name'], candidate['group'])
+
+        for vote in votes:
+            stv.add_voter(vote['voterid'], vote['ballot'])
+    except STVSetupException as e:
+        return None, get_error('Setup', str(e))
+
+    return stv, None
+
+
+def estimate_cost(event, detail: str, aggregate: bool) -> Tuple[float, int]:
+    """ Rough seconds and bytes needed to answer the event at a detail level """
+    ballots = [tuple(vote['ballot']) for vote in event['votes']]
+    entries = sum(len(ballot) for ballot in ballots)  # Progress is kept by voter even when aggregated
+    countedentries = sum(len(ballot) for ballot in set(ballots)) if aggregate else entries
+    candidates = len(event['candidates'])
+    seats = sum(group['seats'] for group in event['groups'])
 
-    stv = STV(usegroups, reactivation)
+    decisions = int(candidates * DECISIONS_PER_CANDIDATE)
+    loops = int(decisions * LOOPS_PER_DECISION)
+    positions = {'loop': loops, 'loopsummary': loops, 'subround': decisions, 'round': seats + 2, 'result': 0}[detail]
+    candidatedicts = decisions if detail == 'loopsummary' else positions
 
-    for group in groups:
-        stv.add_group(group['name'], group['seats'])
+    seconds = countedentries * loops * COUNT_SECONDS + entries * positions * PROGRESS_SECONDS
+    memory = (entries * (ENTRY_BYTES + (positions // KEYFRAME_INTERVAL + 1) * KEYFRAME_BYTES * (positions > 0))
+              + candidatedicts * candidates * CANDIDATE_BYTES + int(positions * entries * CHANGE_SHARE) * CHANGE_BYTES)
+    return seconds, memory
 
-    for candidate in candidates:
-        stv.add_candidate(candidate['code'], candidate['name'], candidate['group'])
 
-    for vote in votes:
-        stv.add_voter(vote['voterid'], vote['ballot'])
+def choose_detail(event) -> Tuple[Optional[str], bool]:
+    """ Most detailed level that fits the budgets, and whether to aggregate ballots. Level None if nothing fits """
+    detail = event.get('detail', 'auto')
+    aggregate = event.get('aggregate', False)
+    if event.get('resultsonly', False):  # Final seats only, without the loop by loop progress
+        detail = 'result'
+
+    if detail != 'auto' and detail not in DETAIL_LEVELS:
+        return detail, aggregate
+    # Only the detail is lowered. Aggregating can break exact ties differently, so it is left to the caller
+    for level in DETAIL_LEVELS if detail == 'auto' else [detail]:
+        seconds, memory = estimate_cost(event, level, aggregate)
+        if seconds <= TIME_BUDGET and memory <= MEMORY_BUDGET:
+            return level, aggregate
+    return None, aggregate
+
+
+def count_records(event, context=None) -> Generator[dict, None, None]:
+    """
+    Count the event, yielding records as soon as they are known: a header, then each loop and a closing index with
+    the navigation links. A result record replaces them at result detail. Errors are yielded as error records
+    Counting stops with a partial index when the time or memory budget runs out
+    """
+    viewvoter = event.get('viewvoter')
+    if len(event['votes']) > VOTES_LIMIT:
+        yield dict(get_error('Function', 'limit is {} votes'.format(VOTES_LIMIT)), record='error')
+        return
+    detail, aggregate = choose_detail(event)
+    if detail not in DETAIL_LEVELS:
+        if detail is None:
+            yield dict(get_error('Function', 'estimated cost exceeds the time or memory budget'), record='error')
+        else:
+            yield dict(get_error('Function', f"unknown detail level {detail}"), record='error')
+        return
+
+    deadline = monotonic() + TIME_BUDGET
+    if context is not None:  # Keep a second to send the response before the invocation times out
+        deadline = min(deadline, monotonic() + context.get_remaining_time_in_millis() / 1000 - 1)
+
+    stv, error = setup_stv(dict(event, aggregate=aggregate))
+    if error is not None:
+        yield dict(error, record='error')
+        return
+    if event.get('profile', False):
+        stv.enable_profiling()
+
+    if detail == 'result':
+        for _ in stv.start(STVStatus.SUBROUND):  # Yields only to check the time
+            if monotonic() > deadline:
+                yield dict(get_error('Function', 'time budget exceeded'), record='error')
+                return
+        record = {'record': 'result', 'quota': stv.quota, 'detail': detail, 'aggregate': aggregate,
+                  'result': stv.result().asdict()}
+        if stv.profile is not None:
+            record['profile'] = stv.profile.asdict()
+        yield record
+        return
 
     if viewvoter not in stv.voters:
         viewvoter = None
-    stvp = STVProgress(stv)
-    # Get Quotas
     initquota = stv.quota
-    winners_quota = {cand.code: cand.wonatquota for cand in stv.winners}
+    yield {'record': 'header', 'quota': initquota, 'viewvoter': viewvoter, 'detail': detail, 'aggregate': aggregate}
 
-    loops = []
-    for t, pos in stvp.get_tansform_and_position():
-        loops.append(pos_to_json(pos, initquota, winners_quota, viewvoter))
+    stvp = STVProgress(stv, stream=True, maxlevel=POSITION_LEVELS[detail])
+    viewtrajectory = stvp.trajectory(viewvoter) if viewvoter is not None else None
+    entries = memory = 0
+    partial = None
+    for _, pos in stvp.stream_tansform_and_position():
+        withcandidates = detail != 'loopsummary' or pos.hasdecision or pos.index == 0
+        winners_quota = {cand.code: cand.wonatquota for cand in stv.winners}  # Winners so far
+        loop = pos_to_json(pos, initquota, winners_quota, viewtrajectory, withcandidates)
+        loop['record'] = 'loop'
+        yield loop
 
-    # Create links
-    lastroundli = len(loops) - 1
-    lastsubroundli = len(loops) - 1
-    lastround = loops[lastroundli]['round']
-    lastsubround = loops[lastsubroundli]['subround']
+        if pos.index == 0:
+            entries = len(stvp.keyframes[0][0])
+            memory = entries * ENTRY_BYTES
+        if pos.index % stvp.keyframeinterval == 0:
+            memory += entries * KEYFRAME_BYTES
+        memory += len(pos.changes) * CHANGE_BYTES + withcandidates * len(stv.candidates) * CANDIDATE_BYTES
+        if monotonic() > deadline:
+            partial = 'time budget exceeded'
+        elif memory > MEMORY_BUDGET:
+            partial = 'memory budget exceeded'
+        if partial is not None:
+            stvp.stop()
+            break
 
-    for i, loop in list(enumerate(loops))[::-1]:
-        loop['nextRound'] = lastroundli
-        loop['nextSubround'] = lastsubroundli
+    links = [stvp.links(i) for i in range(len(stvp.positions))]
+    index = {'record': 'index', 'roundends': stvp.roundends, 'subroundends': stvp.subroundends,
+             'links': {name: [link[name] for link in links] for name in LINK_NAMES}, 'partial': partial is not None}
+    if partial is not None:
+        index['partialReason'] = partial
+    if stv.profile is not None:
+        index['profile'] = stv.profile.asdict()
+    yield index
 
-        if loop['round'] != lastround:
-            lastround = loop['round']
-            lastroundli = i
 
-        if loop['round'] != lastround or loop['subround'] != lastsubround:
-            lastsubround = loop['subround']
-            lastsubroundli = i
+def event_key(event) -> str:
+    """ Cache key of the response to an event. Responses show candidate names, so they are part of it """
+    key = CountKey(event['usegroups'], event['reactivation'], True, engine=event.get('engine', 'object'),
+                   aggregate=event.get('aggregate', False), acceleration=event.get('acceleration'),
+                   detail=event.get('detail', 'auto'), resultsonly=event.get('resultsonly', False),
+                   viewvoter=event.get('viewvoter'), budgets=[TIME_BUDGET, MEMORY_BUDGET])
+    for group in event['groups']:
+        key.add_group(group['name'], group['seats'])
+    for candidate in event['candidates']:
+        key.add_candidate(candidate['code'], candidate['name'], candidate['group'])
+    for vote in event['votes']:
+        key.add_voter(vote['voterid'], vote['ballot'])
+    return key.hexdigest()
 
-    lastroundli = 0
-    lastsubroundli = 0
-    lastround = loops[lastroundli]['nextRound']
-    lastsubround = loops[lastsubroundli]['nextSubround']
 
-    for i, loop in enumerate(loops):
-        loop['previousRound'] = lastroundli
-        loop['previousSubround'] = lastsubroundli
+def lambda_handler(event, context):
+    key = event_key(event)
+    profiled = event.get('profile', False)  # Timings are those of this invocation, so neither read nor cached
+    response = RESULT_CACHE.get(key) if not profiled else None
+    if response is not None:
+        response['cache'] = dict(RESULT_CACHE.statistics(), hit=True)
+        return response
+
+    response = {}
+    loops = []
+    for record in count_records(event, context):
+        recordtype = record.pop('record')
+        if recordtype == 'error':
+            return record
+        elif recordtype == 'loop':
+            loops.append(record)
+        elif recordtype == 'index':
+            for i, loop in enumerate(loops):
+                for name in LINK_NAMES:
+                    loop[name] = record['links'][name][i]
+            response['loops'] = loops
+            response['partial'] = record['partial']
+            if record['partial']:
+                response['partialReason'] = record['partialReason']
+            if 'profile' in record:
+                response['profile'] = record['profile']
+        else:  # Header or result
+            response.update(record)
 
-        if loop['nextRound'] != lastround:
-            lastround = loop['nextRound']
-            lastroundli = i
+    if not response.get('partial', False) and not profiled:  # Partial results depend on the load of the moment
+        RESULT_CACHE.put(key, response)
+    response['cache'] = dict(RESULT_CACHE.statistics(), hit=False)
+    return response
 
-        if loop['nextRound'] != lastround or loop['nextSubround'] != lastsubround:
-            lastsubround = loop['nextSubround']
-            lastsubroundli = i
 
-    return {'quota': stv.quota, 'loops': loops, 'viewvoter': viewvoter}
+def stream_handler(event, context=None) -> Generator[str, None, None]:
+    """
+    Same response as lambda_handler, as JSON lines sent while counting. A header line comes first, then every
+    loop as soon as it is counted. The navigation links of all loops come last, in an index line
+    """
+    for record in count_records(event, context):
+        yield json.dumps(record) + '\n'
 
 
 def get_error(errortype, msg):
@@ -0,0 +1,74 @@
+"""
+Timings and counters of a count, recorded when STV.enable_profiling() is called before start().
+Totals are cumulative over the whole count. Every decision also closes a round event with what was spent on it,
+from the end of the previous decision.
+"""
+from typing import Dict, List, Optional
+
+PHASES = ('allocation', 'reduction', 'sort', 'decision')
+
+
+class Profile:
+    def __init__(self):
+        self.seconds: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self.calls: Dict[str, int] = dict.fromkeys(PHASES, 0)
+        self.visited = 0  # Voters queued for allocation, including those reset since they were queued
+        self.dirty = 0  # Voters actually allocated
+        self.loops = 0  # Main loop iterations to converge
+        self.estimatedsavedloops = 0  # Estimated by acceleration
+        self.reductions: Dict[str, int] = {}  # By winner code
+        self.events: List[dict] = []  # One by decision
+        self._round = self._new_round()
+
+    @staticmethod
+    def _new_round() -> dict:
+        return {'seconds': dict.fromkeys(PHASES, 0.0), 'visited': 0, 'dirty': 0, 'reductions': 0}
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        self.seconds[phase] += seconds
+        self.calls[phase] += 1
+        self._round['seconds'][phase] += seconds
+
+    def add_allocation(self, visited: int, dirty: int, seconds: float) -> None:
+        self.add_time('allocation', seconds)
+        self.visited += visited
+        self.dirty += dirty
+        self._round['visited'] += visited
+        self._round['dirty'] += dirty
+
+    def add_reduction(self, code: str, seconds: float) -> None:
+        self.add_time('reduction', seconds)
+        self.reductions[code] = self.reductions.get(code, 0) + 1
+        self._round['reductions'] += 1
+
+    def end_round(self, rounds: int, subrounds: int, loops: int, estimatedsavedloops: int,
+                  winner: Optional[str], loser: Optional[str]) -> None:
+        """ Close the round event of a decision and start the next one """
+        self.loops += loops
+        self.estimatedsavedloops += estimatedsavedloops
+        self.events.append(dict(self._round, event='decision', round=rounds, subround=subrounds, loops=loops,
+                                estimatedsavedloops=estimatedsavedloops, winner=winner, loser=loser))
+        self._round = self._new_round()
+
+    def asdict(self) -> dict:
+        return {'seconds': self.seconds, 'calls': self.calls, 'visited': self.visited, 'dirty': self.dirty,
+                'loops': self.loops, 'estimatedsavedloops': self.estimatedsavedloops,
+                'reductions': self.reductions, 'events': self.events}
+
+    def summary(self) -> str:
+        """ Table of the totals, for the command line """
+        total = sum(self.seconds.values())
+        lines = [f"{'Phase':<12}{'Calls':>9}{'Seconds':>10}{'Share':>8}"]
+        for phase in PHASES:
+            share = self.seconds[phase] / total if total else 0
+            lines.append(f"{phase:<12}{self.calls[phase]:>9}{self.seconds[phase]:>10.3f}{share:>8.1%}")
+        lines.append(f"{'total':<12}{'':>9}{total:>10.3f}")
+        lines.append("")
+        lines.append(f"Decisions: {len(self.events)}  Loops: {self.loops}  "
+                     f"Estimated saved loops: {self.estimatedsavedloops}")
+        ratio = self.dirty / self.visited if self.visited else 0
+        lines.append(f"Voters visited: {self.visited:,}  Dirty: {self.dirty:,} ({ratio:.1%})")
+        if self.reductions:
+            lines.append("Reductions by winner: " + ', '.join(f"{code} {count}"
+                                                              for code, count in self.reductions.items()))
+        return '\n'.join(lines)
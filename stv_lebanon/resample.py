@@ -0,0 +1,110 @@
+"""
+Bootstrap robustness analysis.
+Ballots are parsed and cleaned once into distinct ballots with their counts. A resample is a vector of
+multiplicities over those distinct ballots, drawn from a seed, so each count adds one voter per distinct ballot
+instead of one per resampled ballot. Resamples are counted on a process pool and give the same results for the same
+seed whatever the number of processes.
+"""
+import multiprocessing
+import random
+from functools import partial
+from itertools import accumulate
+from math import sqrt
+from typing import List, Dict, Tuple, Optional
+
+from .ballots import BallotSet
+from .stv import STV, create_stv
+
+CONFIDENCE_Z = 1.96  # 95% confidence intervals
+CHUNK_SIZE = 16  # Resamples sent to a worker at a time
+
+
+class BallotStore:
+    """ Distinct ballots of a BallotSet, with invalid and repeated codes removed, and how many times each was cast """
+    def __init__(self, ballotset: BallotSet):
+        stv = STV(aggregate=True)
+        ballotset.fill(stv)  # Warnings about invalid ballots are printed once, here
+        self.groups = ballotset.groups
+        self.candidates = ballotset.candidates
+        self.ballots: List[Tuple[str, ...]] = list(stv.ballots)
+        self.counts: List[int] = [voter.multiplicity for voter in stv.ballots.values()]
+        self.ballotcount: int = stv.ballotcount
+        self._cumcounts = list(accumulate(self.counts))
+
+    def resample(self, seed: str) -> List[int]:
+        """ Multiplicities of a bootstrap resample: as many ballots as cast, drawn with replacement """
+        multiplicities = [0] * len(self.ballots)
+        for i in random.Random(seed).choices(range(len(self.ballots)), cum_weights=self._cumcounts,
+                                             k=self.ballotcount):
+            multiplicities[i] += 1
+        return multiplicities
+
+    def fill(self, stv: STV, multiplicities: Optional[List[int]] = None) -> None:
+        """ Add groups, candidates and the distinct ballots, with their counts or the given multiplicities """
+        for groupname, seats in self.groups:
+            stv.add_group(groupname, seats)
+        for code, name, groupname in self.candidates:
+            stv.add_candidate(code, name, groupname)
+        for i, (ballot, multiplicity) in enumerate(zip(self.ballots, multiplicities or self.counts)):
+            if multiplicity:
+                stv.add_voter(f'b{i}', ballot, multiplicity)
+
+
+_store: Optional[BallotStore] = None  # Shared by all resamples counted in a worker
+
+
+def _init_worker(store: BallotStore) -> None:
+    global _store
+    _store = store
+
+
+def count_resamples(resampleindexes: range, seed: int = 0, usegroups: bool = False, reactivation: bool = True,
+                    engine: str = 'object', store: Optional[BallotStore] = None) -> List[List[str]]:
+    """ Winners of each resample. Uses the worker's BallotStore when none is given """
+    store = store if store is not None else _store
+    winners = []
+    for k in resampleindexes:
+        stv = create_stv(engine, usegroups, reactivation)
+        store.fill(stv, store.resample(f'{seed}-{k}'))
+        winners.append([code for code, _ in stv.run_to_completion().winners])
+    return winners
+
+
+def wilson_interval(wins: int, n: int) -> Tuple[float, float]:
+    """ Confidence interval of a win probability, which stays inside [0, 1] even for 0 or n wins """
+    if n == 0:
+        return 0.0, 1.0
+    p = wins / n
+    z2 = CONFIDENCE_Z ** 2
+    center = (p + z2 / (2 * n)) / (1 + z2 / n)
+    halfwidth = CONFIDENCE_Z * sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / (1 + z2 / n)
+    return max(0.0, center - halfwidth), min(1.0, center + halfwidth)
+
+
+def bootstrap(store: BallotStore, resamples: int = 1000, seed: int = 0, processes: Optional[int] = None,
+              usegroups: bool = False, reactivation: bool = True, engine: str = 'object') -> Dict:
+    """ Win probability of every candidate over bootstrap resamples, with confidence intervals """
+    stv = create_stv(engine, usegroups, reactivation)
+    store.fill(stv)
+    fullwinners = {code for code, _ in stv.run_to_completion().winners}
+
+    chunks = [range(start, min(start + CHUNK_SIZE, resamples)) for start in range(0, resamples, CHUNK_SIZE)]
+    count = partial(count_resamples, seed=seed, usegroups=usegroups, reactivation=reactivation, engine=engine)
+    if processes == 1:
+        results = [count(chunk, store=store) for chunk in chunks]
+    else:
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(store,)) as pool:
+            results = pool.map(count, chunks)
+
+    wins = {code: 0 for code, _, _ in store.candidates}
+    for chunkwinners in results:
+        for winners in chunkwinners:
+            for code in winners:
+                wins[code] += 1
+
+    candidates = {}
+    for code, name, groupname in store.candidates:
+        low, high = wilson_interval(wins[code], resamples)
+        candidates[code] = {'name': name, 'group': groupname, 'winner': code in fullwinners, 'wins': wins[code],
+                            'probability': wins[code] / resamples if resamples else 0.0, 'low': low, 'high': high}
+    return {'resamples': resamples, 'seed': seed, 'ballots': store.ballotcount, 'candidates': candidates}
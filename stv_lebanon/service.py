@@ -0,0 +1,375 @@
+"""
+Self hosted counting service.
+Serves the events of lambda_function over HTTP with asyncio. Counts run on a bounded pool of worker processes, so the
+event loop only reads requests and sends responses. Requests beyond the workers wait in a bounded queue, and once it
+is full the service answers 503 with Retry-After instead of taking more work.
+Every count has a deadline, from its arrival plus the timeout of the service or the lower 'timeout' of the event. The
+worker stops counting at the deadline like the lambda does at the end of an invocation, with a partial response.
+
+    POST   /count     Response of lambda_handler. Counts still running after the wait are answered 202 with a job id
+    POST   /jobs      Queue a count and answer 202 with its job id at once
+    GET    /jobs/ID   Status of a job, with its response once done
+    DELETE /jobs/ID   Cancel a job still waiting for a worker
+    POST   /stream    JSON lines of stream_handler, sent while counting
+    GET    /stats     Jobs, workers and result cache
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import multiprocessing.managers
+import os
+import secrets
+import time
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple, Optional
+
+from . import lambda_function
+from .lambda_function import lambda_handler, stream_handler, event_key, get_error, RESULT_CACHE
+
+MAX_BODY = 64 * 2 ** 20  # Bytes of a request body
+JOB_LIFETIME = 600  # Seconds a finished job can still be polled
+GRACE = 5  # Seconds a worker is given past the deadline of its count before the job is reported as timed out
+STATUS_TEXTS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable',
+                504: 'Gateway Timeout'}
+
+
+class Context:
+    """ Stands in for the Lambda context, so count_records stops at the deadline of the job """
+    def __init__(self, deadline: float):
+        self.deadline = deadline  # Wall clock time, shared by all processes
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self.deadline - time.time()) * 1000)
+
+
+def run_event(event: dict, deadline: float) -> dict:
+    """ Response to an event. Runs in a worker process """
+    if time.time() >= deadline:
+        return get_error('Function', 'timed out waiting for a worker')
+    try:
+        return lambda_handler(event, Context(deadline))
+    except (KeyError, TypeError, ValueError) as e:
+        return get_error('Event', f"Malformed event: {e!r}")
+
+
+def stream_event(event: dict, deadline: float, lines, stop) -> None:
+    """
+    Put the JSON lines of an event in the lines queue as they come, then None. Stops counting once the stop event is
+    set. Runs in a worker process
+    """
+    try:
+        if time.time() >= deadline:
+            lines.put(json.dumps(dict(get_error('Function', 'timed out waiting for a worker'), record='error')) + '\n')
+            return
+        for line in stream_handler(event, Context(deadline)):
+            if stop.is_set():  # Client left
+                return
+            lines.put(line)
+    except (KeyError, TypeError, ValueError) as e:
+        lines.put(json.dumps(dict(get_error('Event', f"Malformed event: {e!r}"), record='error')) + '\n')
+    finally:
+        lines.put(None)
+
+
+class Job:
+    def __init__(self, jobid: str, future: asyncio.Future, key: Optional[str],
+                 work: Optional[concurrent.futures.Future] = None):
+        self.id = jobid
+        self.future = future
+        self.work = work  # In the pool of workers. None when answered from the cache
+        self.key = key  # Result cache key. None for streams and profiled counts, whose timings are not reused
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.response: Optional[dict] = None
+        self.timedout = False
+
+    @property
+    def status(self) -> str:
+        if self.timedout:
+            return 'timeout'
+        if self.future.cancelled():
+            return 'cancelled'
+        if self.future.done():
+            return 'done'
+        return 'running' if self.work is not None and self.work.running() else 'queued'
+
+    def cancel(self) -> None:
+        """ Only cancels a job still waiting for a worker """
+        if self.work is not None and self.work.cancel():
+            self.future.cancel()
+
+    def asdict(self) -> dict:
+        j = {'id': self.id, 'status': self.status, 'created': self.created, 'finished': self.finished}
+        if self.response is not None:
+            j['response'] = self.response
+        return j
+
+
+class CountingService:
+    """ Jobs on a pool of worker processes, with a bounded queue in front of it """
+    def __init__(self, workers: Optional[int] = None, queuesize: Optional[int] = None,
+                 timeout: float = lambda_function.TIME_BUDGET, wait: float = 10):
+        self.workers = workers or os.cpu_count() or 1
+        self.queuesize = self.workers * 4 if queuesize is None else queuesize  # Jobs waiting for a worker
+        self.timeout = timeout
+        self.wait = wait  # Seconds /count waits for a response before answering with the job id
+        self.executor = ProcessPoolExecutor(self.workers)
+        self.manager: Optional[multiprocessing.managers.SyncManager] = None  # Started with the first stream
+        self.jobs: Dict[str, Job] = {}
+        self.active = 0  # Jobs queued or running, streams included
+        self.rejected = 0
+
+    def close(self) -> None:
+        for job in self.jobs.values():
+            job.cancel()
+        self.executor.shutdown()
+        if self.manager is not None:
+            self.manager.shutdown()
+
+    @property
+    def full(self) -> bool:
+        return self.active >= self.workers + self.queuesize
+
+    def deadline(self, event: dict) -> float:
+        timeout = event.get('timeout')
+        if not isinstance(timeout, (int, float)) or timeout <= 0:
+            timeout = self.timeout
+        return time.time() + min(timeout, self.timeout)
+
+    def submit(self, event: dict) -> Tuple[Job, bool]:
+        """ A new job counting the event, or a finished one if the result cache has its response """
+        self._forget_old_jobs()
+        key = event_key(event) if not event.get('profile', False) else None
+        jobid = secrets.token_hex(8)
+        cached = RESULT_CACHE.get(key) if key is not None else None
+        if cached is not None:
+            cached['cache'] = dict(RESULT_CACHE.statistics(), hit=True)
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(cached)
+            job = Job(jobid, future, key)
+            self._finish(job, future)
+            self.jobs[jobid] = job
+            return job, True
+
+        deadline = self.deadline(event)
+        work = self.executor.submit(run_event, event, deadline)
+        future = asyncio.wrap_future(work)
+        job = Job(jobid, future, key, work)
+        self.jobs[jobid] = job
+        self.active += 1
+        future.add_done_callback(lambda f: self._finish(job, f, True))
+        asyncio.get_running_loop().call_later(deadline - time.time() + GRACE, self._expire, job)
+        return job, False
+
+    def _finish(self, job: Job, future: asyncio.Future, counted: bool = False) -> None:
+        if counted:
+            self.active -= 1
+        job.finished = time.time()
+        if future.cancelled() or job.timedout:
+            return
+        if future.exception() is not None:  # Anything the worker did not turn into an error response
+            job.response = get_error('Function', f"Count failed: {future.exception()!r}")
+            return
+        job.response = future.result()
+        if (counted and job.key is not None and 'errorType' not in job.response
+                and not job.response.get('partial', False)):
+            RESULT_CACHE.put(job.key, job.response)  # Answered here next time, without a worker
+
+    def _expire(self, job: Job) -> None:
+        """ The worker went past the deadline and its grace. Its response will not be used anymore """
+        if not job.future.done():
+            job.timedout = True
+            job.finished = time.time()
+
+    def _forget_old_jobs(self) -> None:
+        now = time.time()
+        for jobid in [jobid for jobid, job in self.jobs.items()
+                      if job.finished is not None and now - job.finished > JOB_LIFETIME]:
+            del self.jobs[jobid]
+
+    async def stream(self, event: dict, writer: asyncio.StreamWriter) -> None:
+        """ Send the JSON lines of the event as chunks while a worker counts it """
+        if self.manager is None:
+            self.manager = multiprocessing.Manager()
+        lines = self.manager.Queue()
+        stop = self.manager.Event()
+        loop = asyncio.get_running_loop()
+        self.active += 1
+        future = loop.run_in_executor(self.executor, stream_event, event, self.deadline(event), lines, stop)
+        future.add_done_callback(self._finish_stream)  # The worker stays counted until it stops
+        try:
+            while True:
+                line = await loop.run_in_executor(None, lines.get)
+                if line is None:
+                    break
+                data = line.encode()
+                writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+                await writer.drain()
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            await future
+        except (ConnectionResetError, BrokenPipeError):  # Client left. Its count is stopped or never started
+            stop.set()
+            future.cancel()
+            raise
+
+    def _finish_stream(self, future: asyncio.Future) -> None:
+        self.active -= 1
+
+    def statistics(self) -> dict:
+        statuses: Dict[str, int] = {}
+        for job in self.jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {'workers': self.workers, 'queuesize': self.queuesize, 'active': self.active,
+                'rejected': self.rejected, 'jobs': statuses, 'cache': RESULT_CACHE.statistics()}
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """ Method, path, headers and body of the next request. None once the client closed the connection """
+    requestline = await reader.readline()
+    if not requestline.strip():
+        return None
+    method, path, _ = requestline.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        raise ValueError('body too large')
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+
+def send_json(writer: asyncio.StreamWriter, status: int, body: dict, headers: Optional[Dict[str, str]] = None) -> None:
+    data = json.dumps(body).encode()
+    lines = [f'HTTP/1.1 {status} {STATUS_TEXTS[status]}', 'Content-Type: application/json',
+             f'Content-Length: {len(data)}']
+    lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + data)
+
+
+async def handle_request(service: CountingService, method: str, path: str, body: bytes,
+                         writer: asyncio.StreamWriter) -> None:
+    if method == 'GET' and path == '/stats':
+        send_json(writer, 200, service.statistics())
+        return
+    if path.startswith('/jobs/'):
+        job = service.jobs.get(path[len('/jobs/'):])
+        if job is None:
+            send_json(writer, 404, get_error('Service', 'unknown job'))
+        elif method == 'GET':
+            send_json(writer, 200, job.asdict())
+        elif method == 'DELETE':
+            job.cancel()
+            send_json(writer, 200, job.asdict())
+        else:
+            send_json(writer, 405, get_error('Service', 'use GET or DELETE'))
+        return
+    if path not in ('/count', '/jobs', '/stream'):
+        send_json(writer, 404, get_error('Service', 'unknown path'))
+        return
+    if method != 'POST':
+        send_json(writer, 405, get_error('Service', 'use POST'))
+        return
+
+    try:
+        event = json.loads(body)
+        if not isinstance(event, dict):
+            raise ValueError('not an object')
+    except ValueError:
+        send_json(writer, 400, get_error('Event', 'body must be a JSON event'))
+        return
+    if service.full:
+        service.rejected += 1
+        send_json(writer, 503, get_error('Service', 'too many counts waiting. Retry later'),
+                  {'Retry-After': str(max(1, round(service.timeout / 4)))})
+        return
+
+    if path == '/stream':
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n')
+        await service.stream(event, writer)
+        return
+
+    try:
+        job, _ = service.submit(event)
+    except (KeyError, TypeError, ValueError) as e:  # Missing fields found while hashing the event
+        send_json(writer, 400, get_error('Event', f"Malformed event: {e!r}"))
+        return
+    location = {'Location': f'/jobs/{job.id}'}
+    if path == '/count':
+        try:
+            await asyncio.wait_for(asyncio.shield(job.future), service.wait)
+        except asyncio.TimeoutError:
+            pass
+        except Exception:  # The worker failed. _finish recorded the error as the response of the job
+            pass
+        if job.response is not None:
+            failed = job.future.done() and not job.future.cancelled() and job.future.exception() is not None
+            send_json(writer, 500 if failed else 200, job.response, {'X-Job-Id': job.id})
+            return
+    send_json(writer, 202, job.asdict(), location)
+
+
+async def serve_connection(service: CountingService, reader: asyncio.StreamReader,
+                           writer: asyncio.StreamWriter) -> None:
+    """ Answer the requests of one connection, kept alive until the client closes it """
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError) as e:
+                send_json(writer, 413 if 'too large' in str(e) else 400, get_error('Service', 'bad request'))
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            await handle_request(service, method, path, body, writer)
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (ConnectionResetError, BrokenPipeError):  # Client left
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int, service: CountingService) -> None:
+    server = await asyncio.start_server(lambda r, w: serve_connection(service, r, w), host, port)
+    print(f"Counting on http://{host}:{port} with {service.workers} workers. POST an event to /count")
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='stvlebanon-serve', description="Serve STV counts over HTTP")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('-p', dest='port', type=int, default=8080, help="Port to listen on")
+    parser.add_argument('-w', dest='workers', type=int, default=None,
+                        help="Worker processes. One per CPU by default")
+    parser.add_argument('-q', dest='queuesize', type=int, default=None,
+                        help="Counts waiting for a worker before refusing more. Four per worker by default")
+    parser.add_argument('-t', dest='timeout', type=float, default=lambda_function.TIME_BUDGET, metavar="SECONDS",
+                        help="Longest time a count can take from its arrival, waiting included")
+    parser.add_argument('--wait', type=float, default=10, metavar="SECONDS",
+                        help="Time /count waits for a response before answering with a job id to poll")
+    parser_result = parser.parse_args()
+
+    service = CountingService(parser_result.workers, parser_result.queuesize, parser_result.timeout,
+                              parser_result.wait)
+    try:
+        asyncio.run(serve(parser_result.host, parser_result.port, service))
+    except KeyboardInterrupt:
+        print("\nExiting server...")
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
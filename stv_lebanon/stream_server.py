@@ -0,0 +1,77 @@
+"""
+Local wrapper around lambda_function.stream_handler.
+Serves POSTed events over HTTP with chunked transfer, so clients can render loops before the count finishes,
+or streams a single event file to standard output.
+"""
+import argparse
+import json
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+from .lambda_function import stream_handler, get_error
+
+
+def safe_stream(event) -> Iterator[str]:
+    """ stream_handler, ending with an error line instead of raising when the event is malformed """
+    try:
+        yield from stream_handler(event)
+    except (KeyError, TypeError, ValueError) as e:
+        yield json.dumps(dict(get_error('Event', f"Malformed event: {e!r}"), record='error')) + '\n'
+
+
+class StreamRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Chunked transfer needs HTTP/1.1
+
+    def do_POST(self):
+        try:
+            event = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            self.send_error(400, "Body must be a JSON event")
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for line in safe_stream(event):
+                data = line.encode()
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):  # Client left. Closing the generator stops the count
+            self.close_connection = True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='stvlebanon-stream', description="Stream STV counts as JSON lines")
+    parser.add_argument('-i', dest='eventfile', default=None, metavar="FILE",
+                        help="Stream this event file to standard output instead of serving. Use - for stdin")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('-p', dest='port', type=int, default=8000, help="Port to listen on")
+    parser_result = parser.parse_args()
+
+    if parser_result.eventfile is not None:
+        if parser_result.eventfile == '-':
+            event = json.load(sys.stdin)
+        else:
+            with open(parser_result.eventfile) as f:
+                event = json.load(f)
+        for line in safe_stream(event):
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        return
+
+    server = ThreadingHTTPServer((parser_result.host, parser_result.port), StreamRequestHandler)
+    print(f"Streaming counts on http://{parser_result.host}:{parser_result.port}. POST an event as JSON")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nExiting server...")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,17 @@
-from typing import List, Dict, Generator, Final, Optional
+import gc
+from collections.abc import Sequence
+from array import array
+from itertools import repeat
+from math import fsum, ceil, log, isfinite
+from time import perf_counter
+from typing import List, Dict, Tuple, Generator, Final, Optional, Iterable
+
+from .profiling import Profile
+
+
+MIN_TRANSFER: Final = 0.005  # Smaller weights are not transferred. Due to floating point inaccuracy dont compare to 0
+VOTES_PRECISION: Final = 9  # Decimals kept when comparing vote totals. Float noise below it cannot break ties
+SNAPSHOT_VERSION: Final = 1  # Changes whenever snapshot() changes layout
 
 
 class STVSetupException(Exception):
@@ -6,10 +19,13 @@ class STVSetupException(Exception):
 
 
 class Group:
+    __slots__ = ('name', 'seats', 'seatswon', 'candidates')
+
     def __init__(self, name: str, seats: int):
         self.name = name
         self.seats = seats
         self.seatswon = 0
+        self.candidates: List['Candidate'] = []  # In order of addition
 
     @property
     def is_full(self) -> bool:
@@ -17,6 +33,10 @@ class Group:
 
 
 class Candidate:
+    __slots__ = ('code', 'name', 'group', 'votelinks', '_votes', '_votescompensation', '_votesupdates',
+                 'dorefreshvotes', 'wonatquota', 'doreduction', 'partialvls', 'fullvls', 'fullsupporters',
+                 'thresholds')
+
     def __init__(self, code: str, name: str, group: Group):
         self.code = code
         self.name = name
@@ -24,23 +44,52 @@ class Candidate:
         self.votelinks: List[VoteLink] = []
 
         # Running Attributes
-        self._votes: float = 0
-        self.dorefreshvotes = True
+        self._votes: float = 0  # Running total. Updated with every weight change
+        self._votescompensation: float = 0  # Lost low order bits of the running total
+        self._votesupdates = 0  # Updates since last exact sum
+        self.dorefreshvotes = True  # Forces an exact sum of all votelinks on next read
         self.wonatquota: float = 0
         self.doreduction = False
+        self.partialvls: Optional[List[VoteLink]] = None  # Set at first reduction
+        self.fullvls: List[VoteLink] = []
+        self.fullsupporters = 0
+        self.thresholds: List[float] = []  # Full support weight after each reduction. Used for extrapolation
 
     def __repr__(self):
         return f"Candidate({self.code}, {self.name})"
 
     @property
     def votes(self) -> float:
-        """ Cache result to improve performance """
         if self.dorefreshvotes:
             self.dorefreshvotes = False
-            self._votes = 0
-            for vl in self.votelinks:
-                self._votes += vl.weight
-        return self._votes
+            weights = [vl.weight * vl.voter.multiplicity for vl in self.votelinks]
+            self._votes = fsum(weights)
+            weights.append(-self._votes)
+            self._votescompensation = fsum(weights)  # Rounding error of the exact sum
+            self._votesupdates = 0
+        return self._votes + self._votescompensation
+
+    @property
+    def roundedvotes(self) -> float:
+        """ Used for decisions so equal totals reached through different summation orders stay equal """
+        return round(self.votes, VOTES_PRECISION)
+
+    def add_votes(self, delta: float) -> None:
+        """
+        Keep the total up to date when a votelink weight changes.
+        Uses compensated summation, and asks for an exact sum once there were as many updates as votelinks
+        so reading votes stays O(1) on average while float drift cannot build up
+        """
+        total = self._votes + delta
+        if abs(self._votes) >= abs(delta):
+            self._votescompensation += (self._votes - total) + delta
+        else:
+            self._votescompensation += (delta - total) + self._votes
+        self._votes = total
+
+        self._votesupdates += 1
+        if self._votesupdates > len(self.votelinks):
+            self.dorefreshvotes = True
 
     def reduce(self) -> None:
         """
@@ -50,50 +99,131 @@ class Candidate:
         """
         self.doreduction = False
 
-        # Create ordered list of partial votelinks from lowest to highest and list of full votelinks
-        partialvls = []
-        fullvls = []
-        for vl in self.votelinks:
-            if vl.status == vl.FULL:
-                fullvls.append(vl)
-            elif vl.status == vl.PARTIAL and vl.weight > 0:
-                partialvls.append(vl)
+        # Split votelinks once. Afterwards supporters only move from partial to full
+        if self.partialvls is None:
+            self.partialvls = [vl for vl in self.votelinks if vl.status == vl.PARTIAL]
+            self.fullvls = [vl for vl in self.votelinks if vl.status == vl.FULL]
+            self.fullsupporters = sum(vl.voter.multiplicity for vl in self.fullvls)
+
+        # Ordered list of partial votelinks from lowest to highest.
+        # Weights change little between reductions so the list is almost sorted and sorting is close to linear
+        partialvls = self.partialvls
         partialvls.sort(key=lambda x: x.weight)
 
-        totalsupporters = len(fullvls) + len(partialvls)
+        # Skip partial supporters without weight. Weights are sorted so binary search for the first positive one
+        low, high = 0, len(partialvls)
+        while low < high:
+            middle = (low + high) // 2
+            if partialvls[middle].weight > 0:
+                high = middle
+            else:
+                low = middle + 1
+        firstpartial = low
+
+        # Aggregated voters count as many supporters as the ballots they represent
+        totalsupporters = self.fullsupporters + sum(vl.voter.multiplicity for vl in partialvls[firstpartial:])
         partialcount = 0
         partialweight: float = 0
-        for vl in partialvls + fullvls:
+        firstfull = len(partialvls)
+        for i in range(firstpartial, len(partialvls)):
+            vl = partialvls[i]
             threshold = (self.wonatquota - partialweight) / (totalsupporters - partialcount)
             # Threshold is the weight at which a VoteLink can qualify as FULL and the weight at which FULL support
             # will be reduced.
             # As loop progresses, the threshold will increase than stabilize when supporters are able to
             # become full supporters
-            if vl.status == vl.PARTIAL:
-                if vl.weight < threshold:
-                    # Phase 1. partial supporters who cannot give full support
-                    partialcount += 1
-                    partialweight += vl.weight
-                    # This will increase  the threshold on next iteration
-                else:
-                    # Phase 2. partial supporter can now fully support candidate
-                    vl.status = vl.FULL
+            if vl.weight < threshold:
+                # Phase 1. partial supporters who cannot give full support
+                partialcount += vl.voter.multiplicity
+                partialweight += vl.weight * vl.voter.multiplicity
+                # This will increase  the threshold on next iteration
+            else:
+                # Phase 2. this partial supporter and all heavier ones can now fully support candidate.
+                # Threshold will not change anymore
+                firstfull = i
+                break
 
-            # Reduce full support weight for old and new full supporters
-            if vl.status == vl.FULL:
-                vl.weight = threshold
-                self.dorefreshvotes = True  # Have to recalculate weight
-                vl.voter.doallocate = True
-                vl.voter.dorefreshwaste = True  # Have to recalculate waste
+        promoted = partialvls[firstfull:]
+        del partialvls[firstfull:]
+        for vl in promoted:
+            vl.status = vl.FULL
+            self.fullsupporters += vl.voter.multiplicity
+        self.fullvls.extend(promoted)
+
+        if not self.fullvls:
+            return
+        threshold = (self.wonatquota - partialweight) / (totalsupporters - partialcount)
+        self._set_full_weight(threshold)
+        self.thresholds.append(threshold)
+
+    def _set_full_weight(self, threshold: float) -> None:
+        """ Reduce full support weight for old and new full supporters """
+        raisedvoters = []
+        self.add_votes(-fsum(vl.weight * vl.voter.multiplicity for vl in self.fullvls))
+        for vl in self.fullvls:
+            if threshold > vl.weight:
+                # Only after an extrapolation went too far. Later preferences may now get too much weight
+                raisedvoters.append(vl.voter)
+            vl.weight = threshold
+            vl.voter.request_allocation()
+            vl.voter.dorefreshwaste = True  # Have to recalculate waste
+        self.add_votes(threshold * self.fullsupporters)
+
+        for voter in raisedvoters:
+            voter.reflow()
+
+    def extrapolate(self, tolerance: float) -> Optional[Tuple[float, int]]:
+        """
+        Thresholds decrease geometrically while winners pass surplus to each other.
+        Returns the limit of the last thresholds by Aitken's delta-squared method, and an estimate of the main loops
+        a plain iteration needs to get there. None if thresholds do not decrease steadily
+        """
+        if len(self.thresholds) < 4:
+            return None
+        t0, t1, t2, t3 = self.thresholds[-4:]
+        if not t0 > t1 > t2 > t3:
+            return None
+        previousratio = (t1 - t2) / (t0 - t1)
+        ratio = (t2 - t3) / (t1 - t2)
+        if ratio >= 1 or abs(ratio - previousratio) > 0.1 * ratio:  # Not a steady geometric decrease
+            return None
+        step = (t2 - t3) * ratio / (1 - ratio)
+        if step >= t3:
+            return None
+        # Loops a plain iteration would need before its steps get smaller than the tolerance
+        loops = max(ceil(log(tolerance / (t2 - t3)) / log(ratio)), 0) if t2 - t3 > tolerance else 0
+        return t3 - step, loops
+
+    def jump_to_threshold(self, threshold: float) -> None:
+        """ Apply an extrapolated threshold """
+        self.thresholds.clear()
+        self._set_full_weight(threshold)
+        self.doreduction = True  # Reduce again so threshold is corrected from the actual partial supporters
+
+    def demote(self, vl: 'VoteLink', weight: float) -> None:
+        """ A full supporter that cannot give the threshold anymore becomes a partial supporter """
+        self.fullvls.remove(vl)
+        self.fullsupporters -= vl.voter.multiplicity
+        self.partialvls.append(vl)
+        self.add_votes((weight - vl.weight) * vl.voter.multiplicity)
+        vl.status = vl.PARTIAL
+        vl.weight = weight
+        self.doreduction = True
 
 
 class Voter:
-    def __init__(self, uid: str):
+    __slots__ = ('uid', 'votelinks', '_waste', 'dorefreshwaste', 'doallocate', 'multiplicity', 'worklist')
+
+    def __init__(self, uid: str, worklist: Optional[List['Voter']] = None):
         self.uid = uid
         self.votelinks: List[VoteLink] = []  # Links to candidate in order of preference
         self._waste: float = 1
         self.dorefreshwaste = False  # Used to trigger recalculation of waste. Reduces computation
         self.doallocate = True
+        self.multiplicity = 1  # Number of identical ballots represented by this voter when aggregating
+        self.worklist = worklist  # Shared list of voters waiting for allocation. Avoids scanning all voters
+        if worklist is not None:
+            worklist.append(self)
 
     def __repr__(self):
         return f"Voter({self.uid})"
@@ -105,6 +235,30 @@ class Voter:
             self._waste = 1 - sum(vl.weight for vl in self.votelinks)
         return self._waste
 
+    def request_allocation(self) -> None:
+        """ Flag voter for allocation and queue it once in the worklist """
+        if not self.doallocate:
+            self.doallocate = True
+            if self.worklist is not None:
+                self.worklist.append(self)
+
+    def reflow(self) -> None:
+        """ Trim fixed weights that do not fit anymore in the ballot after an earlier preference was raised """
+        remaining = 1.0
+        for vl in self.votelinks:
+            if vl.status in [vl.PARTIAL, vl.FULL] and vl.weight > remaining:
+                if vl.status == vl.FULL:
+                    vl.candidate.demote(vl, remaining)
+                else:
+                    if vl.weight - remaining > MIN_TRANSFER:
+                        vl.candidate.doreduction = True
+                    vl.candidate.add_votes((remaining - vl.weight) * self.multiplicity)
+                    vl.weight = remaining
+            if vl.status in [vl.PARTIAL, vl.FULL]:
+                remaining -= vl.weight
+        self.request_allocation()
+        self.dorefreshwaste = True
+
     def allocate_votes(self) -> None:
         self.doallocate = False
 
@@ -114,16 +268,18 @@ class Voter:
             if vl.status in [vl.PARTIAL, vl.FULL]:
                 total -= vl.weight  # Removing fixed weight
             elif vl.weight > 0:
+                vl.candidate.add_votes(-vl.weight * self.multiplicity)
                 vl.weight = 0
-                vl.candidate.dorefreshvotes = True
 
         # Spread unfixed weight to first Active or Partial votelinks
-        if total > 0.005:  # Due to floating point inaccuracy dont compare to 0
+        if total > MIN_TRANSFER:
             for vl in self.votelinks:
                 if vl.status in [vl.ACTIVE, vl.PARTIAL]:
+                    if vl.weight > 0:  # Partial support keeps its weight
+                        vl.candidate.add_votes(-vl.weight * self.multiplicity)
                     vl.weight += total
+                    vl.candidate.add_votes(vl.weight * self.multiplicity)
                     total = 0
-                    vl.candidate.dorefreshvotes = True
                     # New available support to previous winner
                     if vl.candidate.wonatquota > 0:
                         vl.candidate.doreduction = True
@@ -139,6 +295,8 @@ class VoteLink:
     PARTIAL: Final = 1  # Partial support
     FULL: Final = 2  # Full support
 
+    __slots__ = ('voter', 'candidate', 'weight', 'status')
+
     def __init__(self, voter: Voter, candidate: Candidate):
         self.voter = voter
         self.candidate = candidate
@@ -153,6 +311,78 @@ class VoteLink:
         return f"VoteLink({self.voter}, {self.candidate}, {self.weight:.3f}, {self.status})"
 
 
+class CandidateList(Sequence):
+    """
+    Ordered Candidates with O(1) membership tests, appends and removals.
+    Reads like a list. Positions are materialized lazily and only when indexed.
+    """
+    def __init__(self, candidates: Iterable[Candidate] = ()):
+        self._ranks: Dict[Candidate, int] = {}  # Insertion ordered. Ranks increase along the list
+        self._nextrank = 0
+        self._list: Optional[List[Candidate]] = None
+        for c in candidates:
+            self.append(c)
+
+    def _aslist(self) -> List[Candidate]:
+        if self._list is None:
+            self._list = list(self._ranks)
+        return self._list
+
+    def append(self, candidate: Candidate) -> None:
+        if candidate in self._ranks:
+            raise ValueError(f"Candidate {candidate.code} is already in the list")
+        self._ranks[candidate] = self._nextrank
+        self._nextrank += 1
+        self._list = None
+
+    def remove(self, candidate: Candidate) -> None:
+        try:
+            del self._ranks[candidate]
+        except KeyError:
+            raise ValueError(f"Candidate {candidate.code} is not in the list")
+        self._list = None
+
+    def sort(self, key=None, reverse: bool = False) -> None:
+        """ Stable sort like list.sort """
+        ordered = sorted(self._ranks, key=key, reverse=reverse)
+        self._ranks = {c: rank for rank, c in enumerate(ordered)}
+        self._nextrank = len(ordered)
+        self._list = ordered
+
+    def rank(self, candidate: Candidate) -> int:
+        """ Sort key giving the list order without building positions """
+        return self._ranks[candidate]
+
+    def __contains__(self, candidate) -> bool:
+        return candidate in self._ranks
+
+    def __len__(self) -> int:
+        return len(self._ranks)
+
+    def __iter__(self):
+        return iter(self._aslist())  # Iterates a snapshot so the list can change during the loop
+
+    def __reversed__(self):
+        return reversed(self._aslist())
+
+    def __getitem__(self, index):
+        return self._aslist()[index]
+
+    def __add__(self, other: Iterable[Candidate]) -> List[Candidate]:
+        return self._aslist() + list(other)
+
+    def __radd__(self, other: Iterable[Candidate]) -> List[Candidate]:
+        return list(other) + self._aslist()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (CandidateList, list)):
+            return self._aslist() == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"CandidateList({self._aslist()!r})"
+
+
 class STVStatus:
     """ Result of each counting round """
     # Yield Levels. Used to see level of details
@@ -171,17 +401,49 @@ class STVStatus:
         self.reactivated: Optional[List[Candidate]] = None
 
 
+class STVResult:
+    """ Compact final outcome of a count """
+    def __init__(self, winners: List[Tuple[str, float]], groupseats: Dict[str, int], totalwaste: float):
+        self.winners = winners  # Candidate codes in order of election with the votes each won at
+        self.groupseats = groupseats  # Seats won by group name
+        self.totalwaste = totalwaste
+
+    def asdict(self) -> dict:
+        return {
+            'winners': [{'code': code, 'wonatquota': wonatquota} for code, wonatquota in self.winners],
+            'groupseats': dict(self.groupseats),
+            'totalwaste': self.totalwaste
+        }
+
+    @classmethod
+    def fromdict(cls, d: dict) -> 'STVResult':
+        """ Inverse of asdict """
+        return cls([(w['code'], w['wonatquota']) for w in d['winners']], dict(d['groupseats']), d['totalwaste'])
+
+
 class STV:
     """ Contains the whole voting system and does the counting """
-    def __init__(self, usegroups: bool = False, reactivationmode: bool = False):
+    def __init__(self, usegroups: bool = False, reactivationmode: bool = False, aggregate: bool = False,
+                 acceleration: Optional[float] = None):
+        if acceleration is not None and (isinstance(acceleration, bool) or not isinstance(acceleration, (int, float))
+                                         or not isfinite(acceleration) or acceleration <= 0):
+            raise STVSetupException("Acceleration tolerance must be a positive number")
+
         # Static attributes
         self.usegroups = usegroups
         self.reactivationmode = reactivationmode
+        self.aggregate = aggregate  # Identical ballots share a single weighted Voter
+        self.acceleration = acceleration  # Tolerance of threshold extrapolation. None counts without it
 
         # Input Attributes
         self.groups: Dict[str, Group] = {}
         self.candidates: Dict[str, Candidate] = {}
-        self.voters: Dict[str, Voter] = {}
+        self.voters: Dict[str, Voter] = {}  # Several voter ids can map to the same Voter when aggregating
+        self.ballots: Dict[Tuple[str, ...], Voter] = {}  # Aggregated Voters by preference list
+        self.ballotcount = 0
+        self.dirtyvoters: List[Voter] = []  # Voters flagged with doallocate. Filled by the Voters themselves
+        self.changedvoters: Optional[List[Voter]] = None  # Voters with changed votelinks. None if not tracked
+        self.profile: Optional[Profile] = None  # Timings and counters of the count. None if not profiled
 
         # Variable Running Attributes
         self.totalseats = 0
@@ -191,11 +453,14 @@ class STV:
         self.loopcount = 0
         self.allocationcount = 0
         self.reductioncount = 0
+        self.estimatedsavedloops = 0  # Estimated main loops saved by extrapolation in current subround
+        self.resumephase: Optional[str] = None  # Where start() stands: begin, allocated, reduced, initial, decided, end
+        self.repeatmainloop = False  # Whether the main loop goes on after a reduced yield
 
-        self.winners: List[Candidate] = []
-        self.active: List[Candidate] = []
-        self.deactivated: List[Candidate] = []
-        self.excluded: List[Candidate] = []
+        self.winners = CandidateList()
+        self.active = CandidateList()
+        self.deactivated = CandidateList()
+        self.excluded = CandidateList()
 
     # Setup Methods
     def add_group(self, name: str, seats: int) -> None:
@@ -211,88 +476,167 @@ class STV:
             group = self.groups[groupname]
         except KeyError:
             raise STVSetupException(f"Cannot find Group with name: {groupname}")
-        self.candidates[code] = candidate = Candidate(code, name, group)
+        self.candidates[code] = candidate = self._create_candidate(code, name, group)
         self.active.append(candidate)  # Put all Candidates in the active list
+        group.candidates.append(candidate)
+
+    def _create_candidate(self, code: str, name: str, group: Group) -> Candidate:
+        return Candidate(code, name, group)
 
-    def add_voter(self, uid: str, candlist: List[str]) -> None:
+    def _check_ballot(self, uid: str, candlist: List[str]) -> List[Candidate]:
+        """ Validate voter id and return the ballot's candidates without duplicates or invalid codes """
         if not uid:
             raise STVSetupException("Cannot add Voter with empty code")
         if uid in self.voters:
             raise STVSetupException(f"Voter {uid} was already added")
-        self.voters[uid] = newvoter = Voter(uid)
+        ballot: List[Candidate] = []
         addedcandidates = set()  # Used to check duplicate candidate code
         for ccode in candlist:
             try:
                 if ccode not in addedcandidates:
-                    VoteLink(newvoter, self.candidates[ccode])
+                    ballot.append(self.candidates[ccode])
                     addedcandidates.add(ccode)
                 else:
                     print(f"Warning: Voter {uid} already specified candidate ({ccode}). Ignoring")
             except KeyError:
                 print(f"Warning: Voter {uid} voted used an invalid Candidate Code ({ccode}). Ignoring")
+        return ballot
+
+    def add_voter(self, uid: str, candlist: List[str], multiplicity: int = 1) -> None:
+        """ multiplicity counts the ballot as that many identical ballots cast under one voter id """
+        if multiplicity < 1:
+            raise STVSetupException(f"Voter {uid} must have a positive multiplicity")
+        ballot = self._check_ballot(uid, candlist)
+        self.ballotcount += multiplicity
+        if self.aggregate:
+            key = tuple(c.code for c in ballot)
+            voter = self.ballots.get(key)
+            if voter is not None:
+                voter.multiplicity += multiplicity
+                self.voters[uid] = voter
+                return
+
+        self.voters[uid] = newvoter = Voter(uid, self.dirtyvoters)
+        newvoter.multiplicity = multiplicity
+        for candidate in ballot:
+            VoteLink(newvoter, candidate)
+        if self.aggregate:
+            self.ballots[key] = newvoter
+
+    def add_voters(self, voters: Iterable[Tuple[str, Tuple[str, ...]]],
+                   multiplicities: Optional[Iterable[int]] = None) -> None:
+        """
+        Add many voters in one call. Ballots must already be clean, naming valid candidate codes once each like those
+        of BallotSet.read, so the per ballot checks and warnings of add_voter are skipped
+        multiplicities gives the multiplicity of each voter, instead of 1
+        """
+        if multiplicities is None:
+            multiplicities = repeat(1)
+        candidates = self.candidates
+        allvoters = self.voters
+        ballots = self.ballots
+        dirtyvoters = self.dirtyvoters
+        # Linked objects are created by the million without any garbage. Collecting meanwhile only slows them down
+        gcenabled = gc.isenabled()
+        gc.disable()
+        try:
+            for (uid, codes), multiplicity in zip(voters, multiplicities):
+                if not uid or uid in allvoters:
+                    self._check_ballot(uid, ())  # Raises the same errors as add_voter
+                self.ballotcount += multiplicity
+                if self.aggregate:
+                    key = tuple(codes)
+                    voter = ballots.get(key)
+                    if voter is not None:
+                        voter.multiplicity += multiplicity
+                        allvoters[uid] = voter
+                        continue
+                allvoters[uid] = newvoter = Voter(uid, dirtyvoters)
+                newvoter.multiplicity = multiplicity
+                if self.aggregate:
+                    ballots[key] = newvoter
+                try:
+                    for code in codes:
+                        VoteLink(newvoter, candidates[code])
+                except KeyError as e:
+                    raise STVSetupException(f"Voter {uid} has an invalid Candidate Code ({e.args[0]})")
+        finally:
+            if gcenabled:
+                gc.enable()
 
     @property
     def quota(self) -> float:
-        return len(self.voters) / self.totalseats
+        return self.ballotcount / self.totalseats
 
     @property
     def totalwaste(self) -> float:
-        return float(len(self.voters)) - sum(c.votes for c in self.active + self.winners)
+        return float(self.ballotcount) - sum(c.votes for c in self.active + self.winners)
 
     def _sort_active(self) -> None:
-        self.active.sort(key=lambda candidate: candidate.votes, reverse=True)
+        starttime = perf_counter() if self.profile is not None else 0.0
+        self.active.sort(key=lambda candidate: candidate.roundedvotes, reverse=True)
+        if self.profile is not None:
+            self.profile.add_time('sort', perf_counter() - starttime)
 
-    def start(self) -> Generator:
-        """ Advance to next Round. Either there will be a win, a loss or reactivation. Then do heavy counting """
-        yield STVStatus(STVStatus.BEGIN)
+    def start(self, maxlevel: int = STVStatus.LOOP, resume: bool = False) -> Generator:
+        """
+        Advance to next Round. Either there will be a win, a loss or reactivation. Then do heavy counting
+        Only statuses up to maxlevel are yielded. Bookkeeping that only feeds skipped levels is not done
+        With resume, a count restored from a snapshot goes on after the yield the snapshot was taken at
+        """
+        reportloops = maxlevel >= STVStatus.LOOP
+        phase = self.resumephase if resume else None
+        if phase == 'end':
+            return
+        if phase is None:
+            self.resumephase = phase = 'begin'
+            yield STVStatus(STVStatus.BEGIN)
 
         while True:
-            # Manage Round counting
-            if self.issubround:
-                self.subrounds += 1
-            else:
-                self.rounds += 1
-                self.subrounds = 1
-            self.issubround = True
-            self.loopcount = 0
-
-            # Part 1: General Redistribution of votes
-            loopstatus = STVStatus(STVStatus.LOOP)
-
-            repeatmainloop = True
-            while repeatmainloop:  # Main Loop
-                repeatmainloop = False
-                self.loopcount += 1
-
-                for voter in self.voters.values():  # Allocation Loop
-                    if voter.doallocate:
-                        voter.allocate_votes()  # This can give surplus votes to candidates
-                        self.allocationcount += 1
-                if self.allocationcount > 0:
-                    yield loopstatus
+            if phase in ('begin', 'decided'):
+                # Manage Round counting
+                if self.issubround:
+                    self.subrounds += 1
+                else:
+                    self.rounds += 1
+                    self.subrounds = 1
+                self.issubround = True
+                self.loopcount = 0
+                self.estimatedsavedloops = 0
+                for winner in self.winners:
+                    winner.thresholds.clear()  # Previous decision changed the fixed point
+            elif phase == 'allocated':  # Resumed. Finish what followed the yield
+                self.allocationcount = 0
+            elif phase == 'reduced':
+                self.reductioncount = 0
+
+            if phase != 'initial':
+                # Part 1: General Redistribution of votes
+                loopstatus = STVStatus(STVStatus.LOOP) if reportloops else None
+                yield from self._converge(loopstatus, self.repeatmainloop if phase == 'reduced' else True,
+                                          phase == 'allocated')
+
+                if not reportloops:  # Counters are only shown at loop level
                     self.allocationcount = 0
-
-                for winner in self.winners:  # Reduction Loop
-                    if winner.doreduction:  # If candidate received surplus votes allocate_votes above
-                        repeatmainloop = True  # Repeat Main loop
-                        winner.reduce()  # Return surplus votes to voters and trigger doallocate
-                        self.reductioncount += 1
-                if self.reductioncount > 0:
-                    yield loopstatus
                     self.reductioncount = 0
 
-            self._sort_active()
+                # Needed even without reporting. Ties keep the order of the previous sort
+                self._sort_active()
 
-            if self.rounds == 1 and self.subrounds == 1:  # Show pretty Initial Round for humans
-                yield STVStatus(STVStatus.INITIAL)
+                if self.rounds == 1 and self.subrounds == 1:
+                    self.resumephase = 'initial'
+                    yield STVStatus(STVStatus.INITIAL)  # Show pretty Initial Round for humans
+            phase = 'decided'
 
             # Part 2: Decide
+            decisiontime = perf_counter() if self.profile is not None else 0.0
             decstatus = STVStatus()
             topcandidate = self.active[0]
             # Win. Either Quota is reached, or cannot lose a candidate because active list becomes too small
-            if self.active[0].votes >= self.quota or len(self.winners) + len(self.active) == self.totalseats:
+            quota = round(self.quota, VOTES_PRECISION)
+            if topcandidate.roundedvotes >= quota or len(self.winners) + len(self.active) == self.totalseats:
                 # Register at which vote amount the winner won in case he won below the quota
-                topcandidate.wonatquota = self.quota if topcandidate.votes > self.quota else topcandidate.votes
+                topcandidate.wonatquota = self.quota if topcandidate.roundedvotes > quota else topcandidate.votes
                 # Status set to PARTIAL and let Candidate's Reduce function decide if FULL
                 self._process_candidate(topcandidate, self.active, self.winners, VoteLink.PARTIAL, False)
                 topcandidate.doreduction = True
@@ -306,14 +650,17 @@ class STV:
 
                 # Process group constraints if groupquota is on
                 if self.usegroups and wgroup.is_full:
-                    for c in self.active + self.deactivated:
-                        if c.group == wgroup:
-                            fromlist = self.active if c in self.active else self.deactivated
+                    # Same order as scanning active then deactivated, but only over the group's candidates
+                    for fromlist in (self.active, self.deactivated):
+                        members = sorted((c for c in wgroup.candidates if c in fromlist), key=fromlist.rank)
+                        for c in members:
                             self._process_candidate(c, fromlist, self.excluded, VoteLink.EXCLUDED, True)
                             decstatus.excluded_by_group.append(c)
 
                 if len(self.winners) == self.totalseats:  # Finish and exit loop
                     decstatus.yieldlevel = decstatus.END
+                    self._profile_decision(decstatus, decisiontime)
+                    self.resumephase = 'end'
                     yield decstatus
                     return
                 elif self.reactivationmode:  # If win and not finished and reactivationmode is on
@@ -335,27 +682,288 @@ class STV:
                     raise Exception('Reactivation failed in Round {}.{}'.format(self.rounds, self.subrounds))
 
             decstatus.yieldlevel = decstatus.SUBROUND if self.issubround else decstatus.ROUND
-            yield decstatus
+            self._profile_decision(decstatus, decisiontime)
+            self.resumephase = 'decided'
+            if decstatus.yieldlevel <= maxlevel:
+                yield decstatus
 
-    @staticmethod
-    def _process_candidate(candidate: Candidate,
-                           fromlist: List[Candidate],
-                           tolist: List[Candidate],
+    def _converge(self, loopstatus: Optional[STVStatus], repeatmainloop: bool = True, skipallocation: bool = False,
+                  winners: Optional[List[Candidate]] = None) -> Generator:
+        """
+        Main loop of a round. Allocate votes and reduce winners until no winner has surplus left
+        loopstatus is yielded after every allocation and reduction step. None yields nothing
+        winners are the ones reduced, all by default
+        """
+        if winners is None:
+            winners = self.winners
+        profile = self.profile
+        while repeatmainloop:
+            repeatmainloop = False
+            if skipallocation:
+                skipallocation = False
+            else:
+                self.loopcount += 1
+
+                self.allocationcount += self._allocate()  # This can give surplus votes to candidates
+                if self.allocationcount > 0 and loopstatus is not None:
+                    self.resumephase = 'allocated'
+                    yield loopstatus
+                    self.allocationcount = 0
+
+            for winner in winners:  # Reduction Loop
+                if winner.doreduction:  # If candidate received surplus votes allocate_votes above
+                    repeatmainloop = True  # Repeat Main loop
+                    starttime = perf_counter() if profile is not None else 0.0
+                    winner.reduce()  # Return surplus votes to voters and trigger doallocate
+                    if profile is not None:
+                        profile.add_reduction(winner.code, perf_counter() - starttime)
+                    self._track_candidate(winner)
+                    self.reductioncount += 1
+            if self.acceleration is not None and repeatmainloop:
+                self._extrapolate_winners()
+            if self.reductioncount > 0 and loopstatus is not None:
+                self.resumephase = 'reduced'
+                self.repeatmainloop = repeatmainloop
+                yield loopstatus
+                self.reductioncount = 0
+
+    def run_to_completion(self) -> STVResult:
+        """ Count without reporting intermediate states and return the final result """
+        for _ in self.start(STVStatus.END):
+            pass
+        return self.result()
+
+    def reconverge(self, previousquota: float) -> None:
+        """
+        Bring a finished count to the fixed point of its ballots again after voters were added, keeping every decision.
+        New votelinks take the status of their candidate. Winners elected at the quota aim at the new quota. The last
+        winner and winners elected below the quota are not reduced: they keep what they had and take all new votes
+        """
+        for voter in self.dirtyvoters:  # Only new voters and voters still waiting for allocation
+            for vl in voter.votelinks:
+                c = vl.candidate
+                if vl.status == vl.ACTIVE and c not in self.active:
+                    if c in self.winners:
+                        vl.status = vl.PARTIAL
+                        if c.partialvls is not None:
+                            c.partialvls.append(vl)
+                    else:
+                        vl.status = vl.DEACTIVATED if c in self.deactivated else vl.EXCLUDED
+
+        for c in self.candidates.values():
+            c.dorefreshvotes = True  # Aggregated voters may represent more ballots now
+        previousquota = round(previousquota, VOTES_PRECISION)
+        reduced = []
+        for winner in self.winners:
+            winner.thresholds.clear()
+            if round(winner.wonatquota, VOTES_PRECISION) >= previousquota and winner is not self.winners[-1]:
+                winner.wonatquota = self.quota
+                winner.fullsupporters = sum(vl.voter.multiplicity for vl in winner.fullvls)
+                winner.doreduction = True
+                reduced.append(winner)
+        for _ in self._converge(None, winners=reduced):
+            pass
+        self.allocationcount = 0
+        self.reductioncount = 0
+
+        quota = round(self.quota, VOTES_PRECISION)
+        for winner in self.winners:
+            if winner not in reduced:  # Same rule as when they were elected
+                winner.wonatquota = self.quota if winner.roundedvotes > quota else winner.votes
+                winner.doreduction = False
+
+    def result(self) -> STVResult:
+        """ Compact result of the current state. Final once start() is exhausted """
+        return STVResult([(c.code, c.wonatquota) for c in self.winners],
+                         {g.name: g.seatswon for g in self.groups.values()},
+                         self.totalwaste)
+
+    def snapshot(self) -> dict:
+        """
+        Complete state of the count, ballots included, as plain values and arrays. Valid at any yield of start().
+        Votelinks are numbered voter by voter in ballot order, candidates and voters in order of addition
+        """
+        candidateindexes = {c: i for i, c in enumerate(self.candidates.values())}
+        voters = list(dict.fromkeys(self.voters.values()))  # Aggregated voters once
+        voterindexes = {voter: i for i, voter in enumerate(voters)}
+        votelinks = [vl for voter in voters for vl in voter.votelinks]
+        vlindexes = {vl: i for i, vl in enumerate(votelinks)}
+
+        return {
+            'version': SNAPSHOT_VERSION,
+            'options': (self.usegroups, self.reactivationmode, self.aggregate, self.acceleration),
+            'groups': [(g.name, g.seats, g.seatswon) for g in self.groups.values()],
+            'candidates': [(c.code, c.name, c.group.name, c._votes, c._votescompensation, c._votesupdates,
+                            c.dorefreshvotes, c.wonatquota, c.doreduction,
+                            None if c.partialvls is None else array('I', [vlindexes[vl] for vl in c.partialvls]),
+                            array('I', [vlindexes[vl] for vl in c.fullvls]), c.fullsupporters, list(c.thresholds))
+                           for c in self.candidates.values()],
+            'lists': [array('H', [candidateindexes[c] for c in candlist])
+                      for candlist in (self.winners, self.active, self.deactivated, self.excluded)],
+            'voteruids': [voter.uid for voter in voters],
+            'aliases': [(uid, voterindexes[voter]) for uid, voter in self.voters.items() if uid != voter.uid],
+            'ballotlengths': array('H', [len(voter.votelinks) for voter in voters]),
+            'ballotcandidates': array('H', [candidateindexes[vl.candidate] for vl in votelinks]),
+            'multiplicities': array('I', [voter.multiplicity for voter in voters]),
+            'waste': array('d', [voter._waste for voter in voters]),
+            'voterflags': bytes(voter.dorefreshwaste + 2 * voter.doallocate for voter in voters),
+            'dirtyvoters': array('I', [voterindexes[voter] for voter in self.dirtyvoters]),
+            'weights': array('d', [vl.weight for vl in votelinks]),
+            'statuses': array('b', [vl.status for vl in votelinks]),
+            'counters': (self.ballotcount, self.totalseats, self.rounds, self.issubround, self.subrounds,
+                         self.loopcount, self.allocationcount, self.reductioncount, self.estimatedsavedloops,
+                         self.resumephase, self.repeatmainloop),
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict) -> 'STV':
+        """ Rebuild a count from snapshot(). Go on with start(resume=True) """
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise STVSetupException(f"Snapshot version {snapshot.get('version')} is not {SNAPSHOT_VERSION}")
+        stv = cls(*snapshot['options'])
+        for name, seats, seatswon in snapshot['groups']:
+            stv.add_group(name, seats)
+            stv.groups[name].seatswon = seatswon
+        for code, name, groupname, *_ in snapshot['candidates']:
+            stv.add_candidate(code, name, groupname)
+        candidates = list(stv.candidates.values())
+
+        voters = []
+        votelinks = []
+        ballotcandidates = iter(snapshot['ballotcandidates'])
+        for uid, length, multiplicity, waste, flags in zip(snapshot['voteruids'], snapshot['ballotlengths'],
+                                                            snapshot['multiplicities'], snapshot['waste'],
+                                                            snapshot['voterflags']):
+            voter = Voter(uid)
+            voter.multiplicity = multiplicity
+            voter._waste = waste
+            voter.dorefreshwaste = bool(flags & 1)
+            voter.doallocate = bool(flags & 2)
+            voter.worklist = stv.dirtyvoters
+            for _ in range(length):
+                votelinks.append(VoteLink(voter, candidates[next(ballotcandidates)]))
+            stv.voters[uid] = voter
+            if stv.aggregate:
+                stv.ballots[tuple(vl.candidate.code for vl in voter.votelinks)] = voter
+            voters.append(voter)
+        for uid, voterindex in snapshot['aliases']:
+            stv.voters[uid] = voters[voterindex]
+        stv.dirtyvoters.extend(voters[i] for i in snapshot['dirtyvoters'])
+        for vl, weight, status in zip(votelinks, snapshot['weights'], snapshot['statuses']):
+            vl.weight = weight
+            vl.status = status
+
+        for c, state in zip(candidates, snapshot['candidates']):
+            (c._votes, c._votescompensation, c._votesupdates, c.dorefreshvotes, c.wonatquota, c.doreduction,
+             partialvls, fullvls, c.fullsupporters, c.thresholds) = state[3:]
+            c.partialvls = None if partialvls is None else [votelinks[i] for i in partialvls]
+            c.fullvls = [votelinks[i] for i in fullvls]
+        stv.winners, stv.active, stv.deactivated, stv.excluded = (CandidateList(candidates[i] for i in candlist)
+                                                                  for candlist in snapshot['lists'])
+
+        (stv.ballotcount, stv.totalseats, stv.rounds, stv.issubround, stv.subrounds, stv.loopcount,
+         stv.allocationcount, stv.reductioncount, stv.estimatedsavedloops, stv.resumephase,
+         stv.repeatmainloop) = snapshot['counters']
+        return stv
+
+    def _extrapolate_winners(self) -> None:
+        """
+        Winners pass surplus to each other so their thresholds converge together.
+        Jump all of them to their extrapolated limits at once, when every winner's thresholds decrease steadily
+        and the loops saved are worth it
+        """
+        extrapolations = {}
+        for winner in self.winners:
+            if winner.fullvls:
+                extrapolation = winner.extrapolate(self.acceleration)
+                if extrapolation is None:
+                    return
+                extrapolations[winner] = extrapolation
+        loops = max((loops for _, loops in extrapolations.values()), default=0)
+        if loops <= 1:
+            return
+        for winner, (threshold, _) in extrapolations.items():
+            winner.jump_to_threshold(threshold)
+            self._track_candidate(winner)
+        self.estimatedsavedloops += loops
+        self.reductioncount += len(extrapolations)
+
+    def _allocate(self) -> int:
+        """ Allocation loop, timed when profiling """
+        if self.profile is None:
+            return self._allocate_voters()
+        visited = self._pending_allocations()
+        starttime = perf_counter()
+        count = self._allocate_voters()
+        self.profile.add_allocation(visited, count, perf_counter() - starttime)
+        return count
+
+    def _pending_allocations(self) -> int:
+        """ Voters the next allocation loop will visit """
+        return len(self.dirtyvoters)
+
+    def _allocate_voters(self) -> int:
+        """ Allocation Loop. Only visits voters that changed. Returns the number of allocated voters """
+        count = 0
+        pendingvoters = self.dirtyvoters[:]
+        self.dirtyvoters.clear()
+        if self.changedvoters is not None:
+            self.changedvoters += pendingvoters
+        for voter in pendingvoters:
+            if voter.doallocate:  # Could have been reset after being queued
+                voter.allocate_votes()
+                count += 1
+        return count
+
+    def _process_candidate(self,
+                           candidate: Candidate,
+                           fromlist: CandidateList,
+                           tolist: CandidateList,
                            new_vl_status,
                            votersdoallocate
                            ) -> None:
         """ Transfer candidate and update its votelinks """
         fromlist.remove(candidate)
         tolist.append(candidate)
+        self._track_candidate(candidate)
 
         for vl in candidate.votelinks:
             vl.status = new_vl_status
-            vl.voter.doallocate = votersdoallocate
+            if votersdoallocate:
+                vl.voter.request_allocation()
+            else:
+                vl.voter.doallocate = False
+
+    def track_changes(self) -> None:
+        """ Start recording which Voters get new weights or statuses. Call before start() """
+        self.changedvoters = []
+
+    def pop_changed_voters(self) -> List[Voter]:
+        """ Voters that may have changed since the previous call. Each appears once, in no particular order """
+        voters = list(dict.fromkeys(self.changedvoters))
+        self.changedvoters.clear()
+        return voters
+
+    def _track_candidate(self, candidate: Candidate) -> None:
+        """ Record all supporters of a candidate whose votelinks changed """
+        if self.changedvoters is not None:
+            self.changedvoters += (vl.voter for vl in candidate.votelinks)
+
+    def enable_profiling(self) -> Profile:
+        """ Start recording timings and counters of the count in self.profile. Call before start() """
+        self.profile = Profile()
+        return self.profile
+
+    def _profile_decision(self, status: STVStatus, starttime: float) -> None:
+        if self.profile is not None:
+            self.profile.add_time('decision', perf_counter() - starttime)
+            self.profile.end_round(self.rounds, self.subrounds, self.loopcount, self.estimatedsavedloops,
+                                   status.winner and status.winner.code, status.loser and status.loser.code)
 
     def _reactivate(self, limit: Optional[int] = None) -> List[Candidate]:
         """ Reactivates deactivated Candidates """
         reactivated = []
-        for c in self.deactivated[::-1]:
+        for c in reversed(self.deactivated):
             self._process_candidate(c, self.deactivated, self.active, VoteLink.ACTIVE, True)
             reactivated.append(c)
 
@@ -364,3 +972,22 @@ class STV:
                 break
 
         return reactivated
+
+
+ENGINES: Final = ('object', 'numpy')
+
+
+def create_stv(engine: str = 'object', usegroups: bool = False, reactivationmode: bool = False,
+               aggregate: bool = False, acceleration: Optional[float] = None) -> STV:
+    """ Return an empty STV instance using the requested counting engine """
+    if engine == 'object':
+        return STV(usegroups, reactivationmode, aggregate, acceleration)
+    elif engine == 'numpy':
+        if acceleration is not None:
+            raise STVSetupException("Accelerated convergence is only available with the object engine")
+        try:
+            from .stv_numpy import NumpySTV
+        except ImportError:
+            raise STVSetupException("The numpy engine requires numpy to be installed")
+        return NumpySTV(usegroups, reactivationmode, aggregate)
+    raise STVSetupException(f"Unknown engine: {engine}. Available engines: {', '.join(ENGINES)}")
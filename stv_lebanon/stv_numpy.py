@@ -0,0 +1,397 @@
+"""
+Vectorized counting engine.
+Ballots are held as padded arrays of candidate indexes with matching weight and status matrices. Allocation,
+reduction thresholds and vote totals are computed with array operations instead of walking VoteLink objects.
+Sums are not done in the same order as the object engine, so votes and waste agree with it within rounding. Decisions
+can only differ between candidates closer than that.
+"""
+from array import array
+from collections.abc import Mapping, Sequence
+from itertools import repeat
+from typing import List, Dict, Tuple, Generator, Iterator, Iterable, Final, Optional
+
+import numpy as np
+
+from .stv import STV, STVStatus, Group, Candidate, CandidateList, VoteLink, STVSetupException
+
+PADDING: Final = -1  # Candidate index of unused ballot positions
+
+
+class ArrayCandidate(Candidate):
+    __slots__ = ('engine', 'index')
+
+    def __init__(self, code: str, name: str, group: Group, engine: 'NumpySTV', index: int):
+        super().__init__(code, name, group)
+        self.engine = engine
+        self.index = index
+
+    @property
+    def votes(self) -> float:
+        return float(self.engine.candidatevotes[self.index])
+
+    def reduce(self) -> None:
+        self.doreduction = False
+        self.engine.reduce_candidate(self)
+
+
+class ArrayVoteLink:
+    """ Read only view of one ballot position. Reads like a VoteLink without holding its fields """
+    EXCLUDED, DEACTIVATED, ACTIVE, PARTIAL, FULL = (VoteLink.EXCLUDED, VoteLink.DEACTIVATED, VoteLink.ACTIVE,
+                                                    VoteLink.PARTIAL, VoteLink.FULL)
+    __slots__ = ('engine', 'row', 'column')
+
+    def __init__(self, engine: 'NumpySTV', row: int, column: int):
+        self.engine = engine
+        self.row = row
+        self.column = column
+
+    @property
+    def voter(self) -> 'ArrayVoter':
+        return ArrayVoter(self.engine, self.engine.rowuids[self.row], self.row)
+
+    @property
+    def candidate(self) -> ArrayCandidate:
+        return self.engine.candidatelist[self.engine.ballots_cand[self.row, self.column]]
+
+    @property
+    def weight(self) -> float:
+        return float(self.engine.ballots_weight[self.row, self.column])
+
+    @property
+    def status(self) -> int:
+        return int(self.engine.ballots_status[self.row, self.column])
+
+
+class ArrayVoter:
+    """ Read only view of one ballot row. Reads like a Voter without holding its fields """
+    __slots__ = ('engine', 'uid', 'row')
+
+    def __init__(self, engine: 'NumpySTV', uid: str, row: int):
+        self.engine = engine
+        self.uid = uid
+        self.row = row
+
+    @property
+    def votelinks(self) -> List[ArrayVoteLink]:
+        return [ArrayVoteLink(self.engine, self.row, column) for column in range(self.engine.rowlengths[self.row])]
+
+    def __repr__(self):
+        return f"Voter({self.uid})"
+
+    @property
+    def multiplicity(self) -> int:
+        return self.engine.multiplicities[self.row]
+
+    @property
+    def doallocate(self) -> bool:
+        return bool(self.engine.dirty[self.row]) if self.engine.built else True
+
+    @property
+    def waste(self) -> float:
+        return self.engine.voter_waste(self.row)
+
+
+class VoterMapping(Mapping):
+    """ Maps voter ids to views of their ballot rows """
+    def __init__(self, engine: 'NumpySTV'):
+        self.engine = engine
+        self.rows: Dict[str, int] = {}
+
+    def __getitem__(self, uid: str) -> ArrayVoter:
+        row = self.rows[uid]
+        return ArrayVoter(self.engine, self.engine.rowuids[row], row)  # Shared rows keep their first id like Voter
+
+    def __contains__(self, uid) -> bool:
+        return uid in self.rows
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+class NumpySTV(STV):
+    """ STV with ballots stored in arrays. Same setup methods and yields as STV """
+    def __init__(self, usegroups: bool = False, reactivationmode: bool = False, aggregate: bool = False):
+        super().__init__(usegroups, reactivationmode, aggregate)
+        self.voters = VoterMapping(self)
+        self.candidatelist: List[ArrayCandidate] = []
+
+        # Ballot rows collected during setup, as flat candidate indexes with the offset where each row ends
+        self.rowcandidates = array('i')
+        self.rowends = array('q')
+        self.rowuids: List[str] = []  # First voter id of each row
+        self.multiplicities = array('q')
+        self.rowkeys: Dict[Tuple[int, ...], int] = {}
+        self.rowlengths: Optional[np.ndarray] = None  # Set when arrays are built
+        self.csr: Optional[Tuple[np.ndarray, np.ndarray]] = None  # Offsets and candidate indexes given by add_csr
+
+        # Arrays built when counting starts
+        self.built = False
+        self.ballots_cand: Optional[np.ndarray] = None  # Candidate index per ballot position. PADDING if unused
+        self.ballots_weight: Optional[np.ndarray] = None
+        self.ballots_status: Optional[np.ndarray] = None
+        self.dirty: Optional[np.ndarray] = None  # Rows waiting for allocation
+        self.waste: Optional[np.ndarray] = None
+        self.wastedirty: Optional[np.ndarray] = None
+        self.rowmultiplicity: Optional[np.ndarray] = None
+        self.validpositions: Optional[np.ndarray] = None  # Flat indexes of used ballot positions
+        self.candidatepositions: List[np.ndarray] = []  # Flat indexes of each candidate's ballot positions
+        self._candidatevotes: Optional[np.ndarray] = None
+        self.dorefreshvotes = True
+
+    # Setup Methods
+    def _create_candidate(self, code: str, name: str, group: Group) -> Candidate:
+        candidate = ArrayCandidate(code, name, group, self, len(self.candidatelist))
+        self.candidatelist.append(candidate)
+        return candidate
+
+    def add_voter(self, uid: str, candlist: List[str], multiplicity: int = 1) -> None:
+        if self.built or self.csr is not None:
+            raise STVSetupException("Cannot add Voter after counting started or after CSR ballots")
+        if multiplicity < 1:
+            raise STVSetupException(f"Voter {uid} must have a positive multiplicity")
+        ballot = tuple(c.index for c in self._check_ballot(uid, candlist))
+        self.ballotcount += multiplicity
+        if self.aggregate and ballot in self.rowkeys:
+            row = self.rowkeys[ballot]
+            self.multiplicities[row] += multiplicity
+        else:
+            row = len(self.rowuids)
+            self.rowcandidates.extend(ballot)
+            self.rowends.append(len(self.rowcandidates))
+            self.rowuids.append(uid)
+            self.multiplicities.append(multiplicity)
+            if self.aggregate:
+                self.rowkeys[ballot] = row
+        self.voters.rows[uid] = row
+
+    def add_voters(self, voters: Iterable[Tuple[str, Tuple[str, ...]]],
+                   multiplicities: Optional[Iterable[int]] = None) -> None:
+        """ Add many clean ballots in one call, as rows of candidate indexes. See STV.add_voters """
+        if self.built or self.csr is not None:
+            raise STVSetupException("Cannot add Voter after counting started or after CSR ballots")
+        if multiplicities is None:
+            multiplicities = repeat(1)
+        candidates = self.candidates
+        rows = self.voters.rows
+        for (uid, codes), multiplicity in zip(voters, multiplicities):
+            if not uid or uid in rows:
+                self._check_ballot(uid, ())  # Raises the same errors as add_voter
+            try:
+                ballot = tuple([candidates[code].index for code in codes])
+            except KeyError as e:
+                raise STVSetupException(f"Voter {uid} has an invalid Candidate Code ({e.args[0]})")
+            self.ballotcount += multiplicity
+            if self.aggregate and ballot in self.rowkeys:
+                row = self.rowkeys[ballot]
+                self.multiplicities[row] += multiplicity
+            else:
+                row = len(self.rowuids)
+                self.rowcandidates.extend(ballot)
+                self.rowends.append(len(self.rowcandidates))
+                self.rowuids.append(uid)
+                self.multiplicities.append(multiplicity)
+                if self.aggregate:
+                    self.rowkeys[ballot] = row
+            rows[uid] = row
+
+    def add_csr(self, uids: List[str], offsets: Sequence[int], candidateindexes: Sequence[int],
+                multiplicities: Optional[Sequence[int]] = None) -> None:
+        """
+        Take all ballots at once in CSR layout: row offsets into candidate indexes. Any buffers, like memory mapped
+        arrays, are used as they are when the arrays are built. Rows are not merged, even when aggregating
+        """
+        if self.built or self.rowuids:
+            raise STVSetupException("CSR ballots must be the only ballots")
+        offsets = np.asarray(offsets)  # Buffers are wrapped, not copied
+        candidateindexes = np.asarray(candidateindexes)
+        if len(offsets) != len(uids) + 1 or candidateindexes.max(initial=0) >= max(len(self.candidatelist), 1):
+            raise STVSetupException("CSR ballots do not match the voters and candidates")
+        self.csr = (offsets.astype(np.int64, copy=False), candidateindexes)
+        self.rowuids = list(uids)
+        self.multiplicities = array('q', repeat(1, len(uids)) if multiplicities is None else multiplicities)
+        self.ballotcount += sum(self.multiplicities)
+        self.voters.rows = dict(zip(uids, range(len(uids))))
+        if len(self.voters.rows) != len(uids):
+            raise STVSetupException("CSR ballots repeat a voter id")
+
+    def _build_arrays(self) -> None:
+        if self.csr is not None:
+            offsets, candidateindexes = self.csr
+        else:
+            offsets = np.concatenate(([0], np.frombuffer(self.rowends, dtype=np.int64)))
+            candidateindexes = np.frombuffer(self.rowcandidates, dtype=np.int32)
+        rowcount = len(self.rowuids)
+        lengths = np.diff(offsets).astype(np.int32)
+        width = int(lengths.max(initial=0)) or 1
+        self.ballots_cand = np.full((rowcount, width), PADDING, dtype=np.int32)
+        rows = np.repeat(np.arange(rowcount, dtype=np.int32), lengths)
+        columns = np.arange(len(candidateindexes), dtype=np.int64) - np.repeat(offsets[:-1], lengths)
+        self.ballots_cand[rows, columns] = candidateindexes
+        del rows, columns, candidateindexes, offsets
+        # Ballots now live in the arrays
+        self.csr = None
+        self.rowcandidates = array('i')
+        self.rowends = array('q')
+        self.rowkeys = {}
+        self.rowlengths = lengths
+
+        used = self.ballots_cand != PADDING
+        self.ballots_status = np.full((rowcount, width), VoteLink.EXCLUDED, dtype=np.int8)
+        self.ballots_status[used] = VoteLink.ACTIVE
+        self.ballots_weight = np.zeros((rowcount, width))
+        self.dirty = np.ones(rowcount, dtype=bool)
+        self.waste = np.ones(rowcount)
+        self.wastedirty = np.zeros(rowcount, dtype=bool)
+        self.rowmultiplicity = np.frombuffer(self.multiplicities, dtype=np.int64)  # Shares the setup buffer
+        self.multiplied = bool((self.rowmultiplicity != 1).any())
+        del used
+
+        flatcand = self.ballots_cand.ravel()
+        # Positions fit 32 bits up to 2**31 ballot entries. Halves the index arrays
+        positiontype = np.int32 if flatcand.size < 2 ** 31 else np.int64
+        self.validpositions = np.flatnonzero(flatcand != PADDING).astype(positiontype)
+        # Stable sort keeps each candidate's positions in voter order, like Candidate.votelinks
+        bycandidate = self.validpositions[np.argsort(flatcand[self.validpositions], kind='stable')]
+        counts = np.bincount(flatcand[self.validpositions], minlength=len(self.candidatelist))
+        self.candidatepositions = np.split(bycandidate, np.cumsum(counts)[:-1])
+        self.built = True
+
+    # Counting
+    @property
+    def candidatevotes(self) -> np.ndarray:
+        """ Totals of all candidates. Summed in voter order, so they agree with the object engine within rounding """
+        if self.dorefreshvotes:
+            self.dorefreshvotes = False
+            if not self.built:
+                return np.zeros(len(self.candidatelist))
+            weighted = self.ballots_weight.ravel()[self.validpositions]
+            if self.multiplied:  # Only rows shared by several voters need scaling
+                weighted *= self.rowmultiplicity[self.validpositions // self.ballots_weight.shape[1]]
+            self._candidatevotes = np.bincount(self.ballots_cand.ravel()[self.validpositions], weights=weighted,
+                                               minlength=len(self.candidatelist))
+        return self._candidatevotes
+
+    def voter_waste(self, row: int) -> float:
+        if not self.built:
+            return 1
+        if self.wastedirty[row]:
+            self.wastedirty[row] = False
+            self.waste[row] = 1 - sum(self.ballots_weight[row, :self.rowlengths[row]].tolist())
+        return float(self.waste[row])
+
+    def _pending_allocations(self) -> int:
+        return int(np.count_nonzero(self.dirty))
+
+    def _allocate_voters(self) -> int:
+        rows = np.flatnonzero(self.dirty)
+        if len(rows) == 0:
+            return 0
+        self.dirty[rows] = False
+        status = self.ballots_status[rows]
+        weight = self.ballots_weight[rows]
+
+        # Collect all fixed weight and reset unfixed weight
+        fixed = (status == VoteLink.PARTIAL) | (status == VoteLink.FULL)
+        total = np.ones(len(rows))
+        for column in range(weight.shape[1]):  # Column by column to subtract in ballot order
+            total -= np.where(fixed[:, column], weight[:, column], 0)
+        weight[~fixed] = 0
+
+        # Spread unfixed weight to first Active or Partial position
+        eligible = (status == VoteLink.ACTIVE) | (status == VoteLink.PARTIAL)
+        first = eligible.argmax(axis=1)
+        receiving = np.flatnonzero(eligible.any(axis=1) & (total > 0.005))
+        weight[receiving, first[receiving]] += total[receiving]
+        total[receiving] = 0
+
+        self.ballots_weight[rows] = weight
+        if self.changedvoters is not None:
+            self.changedvoters.append(rows)
+        self.waste[rows] = total
+        self.wastedirty[rows] = False
+        self.dorefreshvotes = True
+
+        # New available support to previous winners
+        for cindex in np.unique(self.ballots_cand[rows[receiving], first[receiving]]).tolist():
+            candidate = self.candidatelist[cindex]
+            if candidate.wonatquota > 0:
+                candidate.doreduction = True
+        return len(rows)
+
+    def reduce_candidate(self, candidate: ArrayCandidate) -> None:
+        """ Same thresholds as Candidate.reduce, computed for all supporters at once """
+        positions = self.candidatepositions[candidate.index]
+        flatstatus = self.ballots_status.reshape(-1)
+        flatweight = self.ballots_weight.reshape(-1)
+        width = self.ballots_cand.shape[1]
+        status = flatstatus[positions]
+        weight = flatweight[positions]
+        multiplicity = self.rowmultiplicity[positions // width]
+
+        full = status == VoteLink.FULL
+        partial = np.flatnonzero((status == VoteLink.PARTIAL) & (weight > 0))
+        partial = partial[np.argsort(weight[partial], kind='stable')]  # Lowest to highest
+        partialweights = weight[partial]
+        partialmultiplicity = multiplicity[partial]
+
+        totalsupporters = int(multiplicity[full].sum()) + int(partialmultiplicity.sum())
+        # Threshold before each partial supporter, as if all previous ones could not give full support
+        partialweight = np.concatenate(([0.], np.cumsum(partialweights * partialmultiplicity)))
+        partialcount = np.concatenate(([0], np.cumsum(partialmultiplicity)))
+        thresholds = (candidate.wonatquota - partialweight[:-1]) / (totalsupporters - partialcount[:-1])
+
+        # Partial supporters from the first one reaching its threshold can fully support candidate
+        promoted = np.flatnonzero(partialweights >= thresholds)
+        if len(promoted):
+            first = promoted[0]
+            full[partial[first:]] = True
+            threshold = thresholds[first]
+        elif full.any():
+            threshold = (candidate.wonatquota - partialweight[-1]) / (totalsupporters - partialcount[-1])
+        else:
+            return
+
+        fullpositions = positions[full]
+        flatstatus[fullpositions] = VoteLink.FULL
+        flatweight[fullpositions] = threshold
+        rows = fullpositions // width
+        self.dirty[rows] = True
+        self.wastedirty[rows] = True
+        self.dorefreshvotes = True
+
+    def _process_candidate(self,
+                           candidate: ArrayCandidate,
+                           fromlist: CandidateList,
+                           tolist: CandidateList,
+                           new_vl_status,
+                           votersdoallocate
+                           ) -> None:
+        fromlist.remove(candidate)
+        tolist.append(candidate)
+        self._track_candidate(candidate)
+
+        positions = self.candidatepositions[candidate.index]
+        self.ballots_status.reshape(-1)[positions] = new_vl_status
+        self.dirty[positions // self.ballots_cand.shape[1]] = votersdoallocate
+
+    def pop_changed_voters(self) -> List[ArrayVoter]:
+        if not self.changedvoters:
+            return []
+        rows = np.unique(np.concatenate(self.changedvoters))
+        self.changedvoters.clear()
+        return [ArrayVoter(self, self.rowuids[row], row) for row in rows.tolist()]
+
+    def _track_candidate(self, candidate: ArrayCandidate) -> None:
+        if self.changedvoters is not None:
+            self.changedvoters.append(self.candidatepositions[candidate.index] // self.ballots_cand.shape[1])
+
+    def start(self, maxlevel: int = STVStatus.LOOP, resume: bool = False) -> Generator:
+        if not self.built:
+            self._build_arrays()
+        yield from super().start(maxlevel, resume)
+
+    def snapshot(self) -> dict:
+        raise STVSetupException("Checkpoints are only available with the object engine")
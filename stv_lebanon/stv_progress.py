@@ -1,12 +1,21 @@
-from typing import List, Optional, Generator
+from typing import List, Dict, Tuple, Optional, Generator, Iterable
+from bisect import bisect_left, bisect_right
 from collections import namedtuple
-from .stv import STV
+from .stv import STV, STVStatus, Voter, VoteLink
 
 Candidate = namedtuple('Candidate', ['code', 'votes'])
 VoteFraction = namedtuple('VoteFraction', ['voterid', 'fraction', 'candidatecode', 'status'])
 
+VL_STATUS_NAMES = {VoteLink.EXCLUDED: "Excluded", VoteLink.DEACTIVATED: "Deactivated", VoteLink.ACTIVE: "Active",
+                   VoteLink.PARTIAL: "Partial", VoteLink.FULL: "Full"}
+KEYFRAME_INTERVAL = 64  # Positions between full snapshots
+
 
 class Position:
+    """
+    State of the count at one yield. Only the vote fractions and waste that changed since the previous Position
+    are kept. Full views are rebuilt on demand by the STVProgress
+    """
     # Loop Type
     UNKNOWN = 0
     REDUCTION = 1
@@ -14,7 +23,7 @@ class Position:
     LOSS = 3
     WIN = 4
 
-    def __init__(self, stv: STV, status, previous_position):
+    def __init__(self, stv: STV, status, progress: 'STVProgress', index: int):
         def tupelize_candidate_list(candlist):
             return [Candidate(c.code, c.votes) for c in candlist]
 
@@ -47,31 +56,27 @@ class Position:
         self.deactivated = tupelize_candidate_list(stv.deactivated)
         self.excluded = tupelize_candidate_list(stv.excluded)
 
-        self.votefractions = {}
-        self.waste = {}  # Key is VoterID
-        for voter in stv.voters.values():
-            vid = voter.uid
-            self.waste[vid] = voter.waste
-            for vl in voter.votelinks:
-                ccode = vl.candidate.code
-                vlstatuscode = {vl.EXCLUDED: "Excluded", vl.DEACTIVATED: "Deactivated", vl.ACTIVE: "Active",
-                                vl.PARTIAL: "Partial", vl.FULL: "Full"}[vl.status]
-                self.votefractions[(vid, ccode)] = VoteFraction(vid, vl.weight, ccode, vlstatuscode)
+        self.progress = progress
+        self.index = index
+        self.changes: List[VoteFraction] = []  # Vote fractions that differ from previous Position
+        self.wastechanges: Dict[str, float] = {}  # Key is VoterID
+        self.totalwaste: float = 0
 
         self.nexttransform: Optional[Transform] = None
 
-        if previous_position is not None:
-            self.add_previous(previous_position)
-
     @property
     def hasdecision(self) -> bool:
         return self.looptype >= self.LOSS
 
-    def add_previous(self, previous: 'Position') -> None:
-        previous.nexttransform = t = Transform(self)
+    @property
+    def votefractions(self) -> Dict[Tuple[str, str], VoteFraction]:
+        """ All vote fractions keyed by VoterID and candidate code. Rebuilt on every access """
+        return self.progress.rebuild(self.index)[0]
 
-        for k, nvf in self.votefractions.items():
-            t.add_difference(previous.votefractions[k], nvf)
+    @property
+    def waste(self) -> Dict[str, float]:
+        """ Waste keyed by VoterID. Rebuilt on every access """
+        return self.progress.rebuild(self.index)[1]
 
 
 class Transform:
@@ -87,19 +92,236 @@ class Transform:
             vflist.append(VoteFraction(nextvf.voterid, abs(weightdiff), nextvf.candidatecode, nextvf.status))
 
 
+class VoterTrajectory:
+    """ Vote fractions, in ballot order, and waste of one voter at every Position """
+    def __init__(self, progress: 'STVProgress', voterid: str):
+        self.progress = progress
+        self.voterid = voterid
+        self.changeindexes: List[int] = []  # Positions where the voter changed. Ascending
+        self.states: List[Tuple[Tuple[VoteFraction, ...], float]] = []  # Fractions and waste from each of them on
+        self.lastindex = -1  # Last Position taken into account
+
+    def at(self, index: int) -> Tuple[Tuple[VoteFraction, ...], float]:
+        if index > self.lastindex:
+            self.progress.extend_trajectory(self)
+        return self.states[bisect_right(self.changeindexes, index) - 1]
+
+    def fractions(self, index: int) -> Tuple[VoteFraction, ...]:
+        return self.at(index)[0]
+
+    def waste(self, index: int) -> float:
+        return self.at(index)[1]
+
+
 class STVProgress:
-    def __init__(self, stv: STV):
-        """ receives a fresh stv instance and creates all positions and transforms """
+    def __init__(self, stv: STV, keyframeinterval: int = KEYFRAME_INTERVAL, stream: bool = False,
+                 maxlevel: int = STVStatus.LOOP):
+        """
+        receives a fresh stv instance and creates all positions and transforms
+        With stream, nothing is counted until positions are pulled from stream_tansform_and_position
+        maxlevel limits positions to STVStatus levels up to it. Transforms then span the skipped levels
+        """
         self.startpos = None
-        currentpos = None
-        for status in stv.start():
+        self.positions: List[Position] = []
+        self.keyframeinterval = keyframeinterval
+        self.finished = False
+
+        # Voter ids sharing each Voter. Ids are numbered in the order the vote fractions are listed
+        self.voterids: Dict[str, List[Tuple[int, str]]] = {}
+        for i, (vid, voter) in enumerate(stv.voters.items()):
+            self.voterids.setdefault(voter.uid, []).append((i, vid))
+
+        # Full snapshots every keyframeinterval Positions. Others are rebuilt from the previous one and the changes
+        self.keyframes: Dict[int, Tuple[Dict[Tuple[str, str], VoteFraction], Dict[str, float]]] = {}
+        self._cursor: Optional[Tuple[int, dict, dict]] = None  # Last rebuilt Position. Speeds up walking forward
+
+        # Positions closing each round and each subround. Used to jump between them. Complete once finished
+        self.roundends: List[int] = []
+        self.subroundends: List[int] = []
+        # First Position of each round, subround and loop
+        self.starts: Dict[tuple, int] = {}
+
+        # Per voter id, the Positions changing it, with the slice of Position.changes holding its vote fractions
+        self.voterchanges: Dict[str, List[Tuple[int, int, int]]] = {}
+        self._indexedpositions = 0
+        self.ballotcodes: Dict[str, Tuple[str, ...]] = {}  # Candidate codes of the ballot by voter id
+        self._trajectories: Dict[str, VoterTrajectory] = {}
+
+        self._counting = self._count(stv, maxlevel)
+        if not stream:
+            for _ in self._counting:
+                pass
+
+    def _count(self, stv: STV, maxlevel: int) -> Generator:
+        """ Run the count, adding and yielding Positions as they are reached """
+        stv.track_changes()
+        votefractions: Dict[Tuple[str, str], VoteFraction] = {}
+        waste: Dict[str, float] = {}
+        try:
+            yield from self._count_positions(stv, maxlevel, votefractions, waste)
+        finally:  # Also when stopped early. The index then covers the positions counted so far
+            if self.positions:
+                for ends in (self.roundends, self.subroundends):
+                    if not ends or ends[-1] != self.positions[-1].index:
+                        ends.append(self.positions[-1].index)
+            self.finished = True
+
+    def _count_positions(self, stv: STV, maxlevel: int, votefractions: Dict[Tuple[str, str], VoteFraction],
+                         waste: Dict[str, float]) -> Generator:
+        for status in stv.start(maxlevel):
             if status.yieldlevel >= 0:
-                newpos = Position(stv, status, currentpos)
+                newpos = Position(stv, status, self, len(self.positions))
 
                 if self.startpos is None:
                     self.startpos = newpos
+                    for vid, voter in stv.voters.items():  # Aggregated voters appear once per voter id
+                        waste[vid] = voter.waste
+                        self.ballotcodes[vid] = tuple(vl.candidate.code for vl in voter.votelinks)
+                        for vl in voter.votelinks:
+                            ccode = vl.candidate.code
+                            votefractions[(vid, ccode)] = VoteFraction(vid, vl.weight, ccode,
+                                                                       VL_STATUS_NAMES[vl.status])
+                    stv.pop_changed_voters()
+                else:
+                    self._record_changes(stv.pop_changed_voters(), newpos, votefractions, waste)
+                    previous = self.positions[-1]
+                    if newpos.round != previous.round:
+                        self.roundends.append(previous.index)
+                    if (newpos.round, newpos.subround) != (previous.round, previous.subround):
+                        self.subroundends.append(previous.index)
+
+                if newpos.index % self.keyframeinterval == 0:
+                    self.keyframes[newpos.index] = (dict(votefractions), dict(waste))
+                newpos.totalwaste = sum(waste.values())
+                for key in ((newpos.round,), (newpos.round, newpos.subround),
+                            (newpos.round, newpos.subround, newpos.loopcount)):
+                    self.starts.setdefault(key, newpos.index)
+                self.positions.append(newpos)
+                yield newpos
+
+    def stop(self) -> None:
+        """ End a streamed count early. Positions counted so far stay available """
+        self._counting.close()
+
+    def _record_changes(self, voters: List[Voter], newpos: Position,
+                        votefractions: Dict[Tuple[str, str], VoteFraction], waste: Dict[str, float]) -> None:
+        """ Compare changed voters with the running state. Keep the differences in newpos and link a Transform """
+        changed = []
+        for voter in voters:
+            votelinks = voter.votelinks
+            voterwaste = voter.waste
+            for i, vid in self.voterids[voter.uid]:
+                if waste[vid] != voterwaste or type(waste[vid]) is not type(voterwaste):  # Int 0 prints unlike 0.0
+                    newpos.wastechanges[vid] = waste[vid] = voterwaste
+                for j, vl in enumerate(votelinks):
+                    ccode = vl.candidate.code
+                    pvf = votefractions[(vid, ccode)]
+                    vlstatus = VL_STATUS_NAMES[vl.status]
+                    if vl.weight != pvf.fraction or vlstatus != pvf.status:
+                        changed.append((i, j, pvf, VoteFraction(vid, vl.weight, ccode, vlstatus)))
+        changed.sort(key=lambda entry: entry[:2])  # Same order as a full scan of the vote fractions
+
+        self.positions[-1].nexttransform = t = Transform(newpos)
+        for _, _, pvf, nvf in changed:
+            newpos.changes.append(nvf)
+            votefractions[(nvf.voterid, nvf.candidatecode)] = nvf
+            t.add_difference(pvf, nvf)
+
+    def rebuild(self, index: int) -> Tuple[Dict[Tuple[str, str], VoteFraction], Dict[str, float]]:
+        """ Copies of all vote fractions and waste at the Position with the given index """
+        keyindex = index - index % self.keyframeinterval
+        if self._cursor is None or not keyindex <= self._cursor[0] <= index:
+            keyvotefractions, keywaste = self.keyframes[keyindex]
+            self._cursor = (keyindex, dict(keyvotefractions), dict(keywaste))
+        cursorindex, votefractions, waste = self._cursor
+        for pos in self.positions[cursorindex + 1:index + 1]:
+            for vf in pos.changes:
+                votefractions[(vf.voterid, vf.candidatecode)] = vf
+            waste.update(pos.wastechanges)
+        self._cursor = (index, votefractions, waste)
+        return dict(votefractions), dict(waste)
+
+    def _index_voter_changes(self) -> None:
+        """ Add Positions counted since last call to voterchanges """
+        for pos in self.positions[self._indexedpositions:]:
+            start = 0
+            changes = pos.changes
+            while start < len(changes):  # Changes are grouped by voter
+                vid = changes[start].voterid
+                end = start + 1
+                while end < len(changes) and changes[end].voterid == vid:
+                    end += 1
+                self.voterchanges.setdefault(vid, []).append((pos.index, start, end))
+                start = end
+            for vid in pos.wastechanges:
+                entries = self.voterchanges.setdefault(vid, [])
+                if not entries or entries[-1][0] != pos.index:
+                    entries.append((pos.index, 0, 0))
+        self._indexedpositions = len(self.positions)
+
+    def trajectories(self, voterids: Iterable[str]) -> Dict[str, VoterTrajectory]:
+        """ Histories of many voters at once. Only their own changes are read """
+        return {vid: self.trajectory(vid) for vid in voterids}
+
+    def trajectory(self, voterid: str) -> VoterTrajectory:
+        if voterid not in self._trajectories:
+            self._trajectories[voterid] = VoterTrajectory(self, voterid)
+        return self._trajectories[voterid]
+
+    def extend_trajectory(self, trajectory: VoterTrajectory) -> None:
+        """ Bring a trajectory up to the last counted Position """
+        self._index_voter_changes()
+        vid = trajectory.voterid
+        if trajectory.lastindex < 0:
+            keyvotefractions, keywaste = self.keyframes[0]
+            trajectory.changeindexes.append(0)
+            trajectory.states.append((tuple(keyvotefractions[(vid, ccode)] for ccode in self.ballotcodes[vid]),
+                                      keywaste[vid]))
+        entries = self.voterchanges.get(vid, [])
+        fractions, waste = trajectory.states[-1]
+        for index, start, end in entries[bisect_right(entries, (trajectory.lastindex, float('inf'))):]:
+            pos = self.positions[index]
+            if start < end:
+                newfractions = {vf.candidatecode: vf for vf in pos.changes[start:end]}
+                fractions = tuple(newfractions.get(vf.candidatecode, vf) for vf in fractions)
+            waste = pos.wastechanges.get(vid, waste)
+            trajectory.changeindexes.append(index)
+            trajectory.states.append((fractions, waste))
+        trajectory.lastindex = len(self.positions) - 1
+
+    def seek(self, round_: int, subround: Optional[int] = None, loop: Optional[int] = None) -> Position:
+        """ First Position of a round, subround or loop """
+        key = (round_, subround, loop)[:3 if loop is not None else 2 if subround is not None else 1]
+        try:
+            return self.positions[self.starts[key]]
+        except KeyError:
+            raise KeyError('No position at ' + '.'.join(map(str, key)))
+
+    def slice(self, start: int, end: Optional[int] = None) -> List[Tuple[Optional[Transform], Position]]:
+        """ Transform and Position pairs for Position indexes start to end, like get_tansform_and_position """
+        return [(self.positions[pos.index - 1].nexttransform if pos.index > 0 else None, pos)
+                for pos in self.positions[start:end]]
+
+    def links(self, index: int) -> Dict[str, int]:
+        """ Indexes of the Positions closing the next and previous round and subround """
+        last = len(self.positions) - 1
+        nextround = bisect_right(self.roundends, index)
+        nextsubround = bisect_right(self.subroundends, index)
+        previousround = bisect_left(self.roundends, index)
+        previoussubround = bisect_left(self.subroundends, index)
+        return {
+            'nextRound': self.roundends[nextround] if nextround < len(self.roundends) else last,
+            'nextSubround': self.subroundends[nextsubround] if nextsubround < len(self.subroundends) else last,
+            'previousRound': self.roundends[previousround - 1] if previousround > 0 else 0,
+            'previousSubround': self.subroundends[previoussubround - 1] if previoussubround > 0 else 0
+        }
 
-                currentpos = newpos
+    def stream_tansform_and_position(self) -> Generator:
+        """ Same pairs as get_tansform_and_position, counting as they are pulled when created with stream """
+        for pos in self.positions:
+            yield (self.positions[pos.index - 1].nexttransform if pos.index > 0 else None), pos
+        for pos in self._counting:
+            yield (self.positions[pos.index - 1].nexttransform if pos.index > 0 else None), pos
 
     def get_tansform_and_position(self) -> Generator:
         if self.startpos is None:
@@ -0,0 +1,95 @@
+"""
+Scenario sweeps.
+Counts one BallotSet under every combination of group quotas, reactivation and seat allocations on a process pool.
+The ballots reach each worker once, when it starts. Only scenarios and results travel afterwards.
+"""
+import multiprocessing
+import time
+from functools import partial
+from itertools import product
+from typing import List, Dict, Optional, Iterable, Iterator, NamedTuple
+
+from .ballots import BallotSet
+from .stv import create_stv
+
+
+class Scenario(NamedTuple):
+    seatsname: str  # Name of the seat allocation. 'default' keeps the seats of the groups file
+    usegroups: bool
+    reactivation: bool
+    seats: Optional[Dict[str, int]] = None  # Seats replaced by group name
+
+    @property
+    def name(self) -> str:
+        return ' '.join([self.seatsname] + ['-g'] * self.usegroups + ['-n'] * (not self.reactivation))
+
+
+def scenario_grid(seatconfigs: Optional[Dict[str, Dict[str, int]]] = None) -> List[Scenario]:
+    """ The four combinations of -g and -n, with the default seats then with each named seat allocation """
+    configs: Dict[str, Optional[Dict[str, int]]] = {'default': None}
+    configs.update(seatconfigs or {})
+    return [Scenario(seatsname, usegroups, reactivation, seats)
+            for seatsname, seats in configs.items()
+            for usegroups, reactivation in product((False, True), (True, False))]
+
+
+_ballotset: Optional[BallotSet] = None  # Shared by all scenarios counted in a worker
+
+
+def _init_worker(ballotset: BallotSet) -> None:
+    global _ballotset
+    _ballotset = ballotset
+
+
+def count_scenario(scenario: Scenario, engine: str = 'object', aggregate: bool = False,
+                   ballotset: Optional[BallotSet] = None) -> dict:
+    """
+    Count one scenario to completion. Uses the worker's BallotSet when none is given
+    Any failure is returned as the record's error instead of raised
+    """
+    ballotset = ballotset if ballotset is not None else _ballotset
+    record = {'scenario': scenario.name, 'seats': scenario.seatsname, 'usegroups': scenario.usegroups,
+              'reactivation': scenario.reactivation}
+    starttime = time.perf_counter()
+    try:
+        stv = create_stv(engine, scenario.usegroups, scenario.reactivation, aggregate)
+        ballotset.fill(stv, scenario.seats)
+        result = stv.run_to_completion()
+    except Exception as e:  # Seat allocations can make a count fail. Reported with the scenario, so the sweep goes on
+        record['error'] = f"{type(e).__name__}: {e}"
+        return record
+    record.update(winners=[code for code, _ in result.winners], groupseats=result.groupseats,
+                  waste=result.totalwaste, wasteratio=result.totalwaste / stv.ballotcount if stv.ballotcount else 0.0,
+                  rounds=stv.rounds, time=time.perf_counter() - starttime)
+    return record
+
+
+def sweep(ballotset: BallotSet, scenarios: Iterable[Scenario], processes: Optional[int] = None,
+          engine: str = 'object', aggregate: bool = False) -> Iterator[dict]:
+    """ Count the scenarios on a pool of processes. Results come in scenario order. One process counts inline """
+    count = partial(count_scenario, engine=engine, aggregate=aggregate)
+    if processes == 1:
+        for scenario in scenarios:
+            yield count(scenario, ballotset=ballotset)
+        return
+
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(ballotset,)) as pool:
+        yield from pool.imap(count, scenarios)
+
+
+def format_table(results: List[dict]) -> str:
+    """ Winners, waste and rounds by scenario. Changes are winners gained and lost against the first scenario """
+    width = max([len(','.join(r.get('winners', []))) for r in results] + [len('Winners')]) + 2
+    lines = [f"{'Scenario':<24}{'Rounds':>7}{'Waste':>7}  {'Winners':<{width}}Changes"]
+    reference = None
+    for r in results:
+        if 'error' in r:
+            lines.append(f"{r['scenario']:<24}error: {r['error']}")
+            continue
+        if reference is None:
+            reference = set(r['winners'])
+        changes = [f'+{code}' for code in r['winners'] if code not in reference]
+        changes += [f'-{code}' for code in sorted(reference - set(r['winners']))]
+        lines.append(f"{r['scenario']:<24}{r['rounds']:>7}{r['wasteratio']:>7.1%}  {','.join(r['winners']):<{width}}"
+                     f"{' '.join(changes)}")
+    return '\n'.join(lines)
@@ -0,0 +1,77 @@
+import copy
+import json
+import os
+import tempfile
+from stv_lebanon.cache import CountKey, ResultCache
+from stv_lebanon.lambda_function import event_key
+
+GROUPS = [('christian', 2), ('muslim', 2)]
+CANDIDATES = [('a', 'Alice', 'christian'), ('b', 'Bob', 'christian'), ('c', 'Carla', 'muslim'),
+              ('d', 'Dany', 'muslim')]
+VOTERS = [('v1', ['a', 'c']), ('v2', ['b']), ('v3', ['c', 'd', 'a'])]
+
+
+def key(groups=GROUPS, candidates=CANDIDATES, voters=VOTERS, usegroups=True, **options):
+    countkey = CountKey(usegroups, True, **options)
+    for name, seats in groups:
+        countkey.add_group(name, seats)
+    for code, name, groupname in candidates:
+        countkey.add_candidate(code, name, groupname)
+    countkey.add_voters(voters)
+    return countkey.hexdigest()
+
+
+# Keys
+reference = key()
+assert key() == reference
+assert key(candidates=[(code, name.upper(), groupname) for code, name, groupname in CANDIDATES]) == reference
+assert key(usegroups=False) != reference
+assert key(aggregate=True) != reference
+assert key(engine='object', aggregate=False) != key(aggregate=False, engine='numpy')
+assert key(engine='object', aggregate=False) == key(aggregate=False, engine='object')  # Option order is irrelevant
+assert key(groups=[('christian', 2), ('muslim', 1)]) != reference
+assert key(voters=VOTERS[::-1]) != reference  # Order breaks ties
+assert key(voters=VOTERS[:2] + [('v3', ['c', 'a', 'd'])]) != reference
+print("Keys: same count, same key. Any change that can change results changes it")
+
+# Responses show candidate names, so the key of a response changes with them
+with open('sample.json') as f:
+    event = json.load(f)
+renamed = copy.deepcopy(event)
+renamed['candidates'][0]['name'] += ' Jr'
+assert event_key(copy.deepcopy(event)) == event_key(event)
+assert event_key(renamed) != event_key(event)
+print("Response keys: names change them")
+
+# Memory entries are evicted least recently used first
+cache = ResultCache(maxentries=2)
+cache.put('k1', {'n': 1})
+cache.put('k2', {'n': 2})
+assert cache.get('k1') == {'n': 1}  # k2 is now the least recently used
+cache.put('k3', {'n': 3})
+assert cache.get('k2') is None
+assert cache.get('k1') == {'n': 1} and cache.get('k3') == {'n': 3}
+value = cache.get('k1')
+value['n'] = 10
+assert cache.get('k1') == {'n': 1}  # Stored results cannot be altered through returned ones
+assert cache.statistics()['entries'] == 2
+assert (cache.hits, cache.misses) == (5, 1)
+print("Memory:", cache.statistics())
+
+# Files outlive the memory entries and are evicted by size, least recently used first
+with tempfile.TemporaryDirectory() as directory:
+    payload = 'x' * 1000
+    cache = ResultCache(maxentries=1, directory=directory, maxbytes=2500)
+    cache.put('k1', payload)
+    cache.put('k2', payload)
+    os.utime(os.path.join(directory, 'k1.json'), (0, 0))
+    os.utime(os.path.join(directory, 'k2.json'), (1, 1))
+    assert ResultCache(directory=directory).get('k1') == payload  # New cache, as after a restart
+    cache.put('k3', payload)  # k2 is now the oldest file
+    assert sorted(os.listdir(directory)) == ['k1.json', 'k3.json']
+    assert cache.get('k1') == payload and cache.diskhits == 1
+
+    with open(os.path.join(directory, 'k3.json'), 'w') as f:
+        f.write('{"cut')  # Cut short by a crash
+    assert ResultCache(directory=directory).get('k3') is None
+    print("Files:", sorted(os.listdir(directory)), cache.statistics())
@@ -0,0 +1,59 @@
+import contextlib
+import io
+import os
+import tempfile
+from itertools import islice, product
+from stv_lebanon.checkpoint import save_checkpoint, load_checkpoint
+from stv_lebanon.cli_interface import load
+from stv_lebanon.stv import STV, STVStatus, STVSetupException
+
+EVERY = 7  # Resume from every 7th yield
+
+with contextlib.redirect_stdout(io.StringIO()):
+    ballotset = load(True)
+
+
+def new_stv(options):
+    stv = STV(*options)
+    ballotset.fill(stv)
+    return stv
+
+
+def trace(stv, statuses):
+    """ What can be seen of the count at each yield """
+    return [(status.yieldlevel, stv.rounds, stv.subrounds, stv.loopcount, status.winner and status.winner.code,
+             status.loser and status.loser.code, round(sum(c.votes for c in stv.active + stv.winners), 9))
+            for status in statuses]
+
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'count.ckpt')
+    # Group quotas and reactivation, each plain then aggregated with acceleration. At loops, and at subrounds like the
+    # command line without a voter to watch
+    for level, usegroups, reactivation, (aggregate, acceleration) in product((STVStatus.LOOP, STVStatus.SUBROUND),
+                                                                             (False, True), (True, False),
+                                                                             ((False, None), (True, 0.01))):
+        options = (usegroups, reactivation, aggregate, acceleration)
+        reference = new_stv(options)
+        referencetrace = trace(reference, reference.start(level))
+        referenceresult = reference.result().asdict()
+
+        for k in range(0, len(referencetrace), EVERY):
+            stv = new_stv(options)
+            before = trace(stv, islice(stv.start(level), k + 1))
+            save_checkpoint(stv, path)
+            resumed = load_checkpoint(path)
+            after = trace(resumed, resumed.start(level, resume=True))
+            assert before + after == referencetrace, (level, options, k)
+            assert resumed.result().asdict() == referenceresult, (level, options, k)
+        print(f"Level: {level}  Groups: {usegroups!s:<6} Reactivation: {reactivation!s:<6} "
+              f"Aggregate: {aggregate!s:<6} Acceleration: {acceleration}  Same count from {len(range(0, len(referencetrace), EVERY))} resumes")
+
+    with open(path, 'wb') as f:
+        f.write(b'not a checkpoint')
+    try:
+        load_checkpoint(path)
+    except STVSetupException as e:
+        print("Bad checkpoint rejected:", e)
+    else:
+        raise AssertionError("Bad checkpoint was loaded")
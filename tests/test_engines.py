@@ -0,0 +1,45 @@
+import contextlib
+import io
+import sys
+from stv_lebanon.cli_interface import load
+from stv_lebanon.stv import STVStatus, STVSetupException, create_stv
+from benchmarks.generators import Election
+
+TOLERANCE = 1e-9  # Engines add votes in a different order
+
+try:
+    create_stv('numpy')
+except STVSetupException as e:
+    print("Skipped:", e)
+    sys.exit()
+
+with contextlib.redirect_stdout(io.StringIO()):
+    sample = load(True)
+sources = [('sample', sample), ('generated', Election(2000, 0, 'beirut2'))]
+
+
+def count(engine, source, usegroups, reactivation, aggregate):
+    """ Decisions in order and the result """
+    stv = create_stv(engine, usegroups, reactivation, aggregate)
+    source.fill(stv)
+    decisions = [(status.winner and status.winner.code, status.loser and status.loser.code,
+                  [c.code for c in status.excluded_by_group], [c.code for c in status.reactivated or ()])
+                 for status in stv.start(STVStatus.SUBROUND)]
+    return decisions, stv.result()
+
+
+for name, source in sources:
+    for usegroups in (False, True):
+        for reactivation in (True, False):
+            for aggregate in (False, True):
+                options = (usegroups, reactivation, aggregate)
+                objectdecisions, objectresult = count('object', source, *options)
+                numpydecisions, numpyresult = count('numpy', source, *options)
+                assert objectdecisions == numpydecisions, (name, options)
+                assert [code for code, _ in objectresult.winners] == [code for code, _ in numpyresult.winners]
+                for (_, objectvotes), (_, numpyvotes) in zip(objectresult.winners, numpyresult.winners):
+                    assert abs(objectvotes - numpyvotes) < TOLERANCE, (name, options)
+                assert objectresult.groupseats == numpyresult.groupseats
+                assert abs(objectresult.totalwaste - numpyresult.totalwaste) < TOLERANCE, (name, options)
+                print(f"{name:<10} Groups: {usegroups!s:<6} Reactivation: {reactivation!s:<6} "
+                      f"Aggregate: {aggregate!s:<6} Same decisions and result")
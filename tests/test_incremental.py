@@ -0,0 +1,39 @@
+import contextlib
+import io
+from stv_lebanon.cli_interface import load
+from stv_lebanon.incremental import IncrementalCount
+from stv_lebanon.stv import STV
+
+with contextlib.redirect_stdout(io.StringIO()):
+    ballotset = load(True)
+
+
+def full_winners(ballots, usegroups, reactivation):
+    stv = STV(usegroups, reactivation)
+    for groupname, seats in ballotset.groups:
+        stv.add_group(groupname, seats)
+    for code, name, groupname in ballotset.candidates:
+        stv.add_candidate(code, name, groupname)
+    stv.add_voters(ballots)
+    return sorted(code for code, _ in stv.run_to_completion().winners)
+
+
+# Copies of the sample ballots under new voter ids shift every total in proportion, so decisions can stand
+warmstarts = 0
+for usegroups in (False, True):
+    for reactivation in (True, False):
+        incremental = IncrementalCount(ballotset.groups, ballotset.candidates, usegroups, reactivation)
+        ballots = []
+        for k in range(4):
+            batch = [(f'{uid}-{k}', ballot) for uid, ballot in ballotset.ballots]
+            ballots += batch
+            provisional = incremental.add_batch(batch)
+            winners = sorted(code for code, _ in provisional.result.winners)
+            if provisional.warm:
+                warmstarts += 1
+                assert winners == sorted(code for code, _ in incremental.final().winners)
+            assert winners == full_winners(ballots, usegroups, reactivation), (usegroups, reactivation, k)
+        print(f"Groups: {usegroups}  Reactivation: {reactivation}  Same winners as full counts")
+
+assert warmstarts > 0
+print("Warm starts:", warmstarts)